@@ -2,7 +2,7 @@ import dotenv, os
 
 dotenv.load_dotenv()
 
-global TOKEN, VERSION, SUPPORT_SERVER, DB_HOST, DB_USER, DB_PASS, DB_NAME, APP_DIR, LOG_DIR, INVITE_URL, WIKI_URL
+global TOKEN, VERSION, SUPPORT_SERVER, DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, TASK_CONCURRENCY, STAT_FLUSH_TIME, STAT_FLUSH_SIZE, GUILD_CACHE_TTL, USER_CACHE_TTL, USER_CACHE_SIZE, CHANNEL_CACHE_TTL, CHANNEL_CACHE_SIZE, LEADERBOARD_INTERVAL, CACHE_BUS, APP_DIR, LOG_DIR, INVITE_URL, WIKI_URL
 
 TOKEN = os.getenv("TOKEN")
 VERSION = os.getenv("VERSION")
@@ -11,6 +11,19 @@ DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+TASK_CONCURRENCY = int(os.getenv("TASK_CONCURRENCY", 10))
+STAT_FLUSH_TIME = float(os.getenv("STAT_FLUSH_TIME", 10))
+STAT_FLUSH_SIZE = int(os.getenv("STAT_FLUSH_SIZE", 500))
+GUILD_CACHE_TTL = float(os.getenv("GUILD_CACHE_TTL", 300))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+CHANNEL_CACHE_TTL = float(os.getenv("CHANNEL_CACHE_TTL", 3600))
+CHANNEL_CACHE_SIZE = int(os.getenv("CHANNEL_CACHE_SIZE", 1000))
+LEADERBOARD_INTERVAL = float(os.getenv("LEADERBOARD_INTERVAL", 5))
+CACHE_BUS = os.getenv("CACHE_BUS", "local")
 INVITE_URL = os.getenv("INVITE_URL")
 WIKI_URL = os.getenv("WIKI_URL")
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS schema_version (
+    id INTEGER PRIMARY KEY auto_increment,
+    version BIGINT NOT NULL,
+    step INTEGER NOT NULL DEFAULT 0,
+    position BIGINT NOT NULL DEFAULT 0,
+    completed BIGINT NOT NULL DEFAULT 0,
+    UNIQUE KEY version (version)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS sprint_channels (
+    id INTEGER PRIMARY KEY auto_increment,
+    sprint INTEGER NOT NULL,
+    guild BIGINT UNSIGNED NOT NULL,
+    channel BIGINT UNSIGNED NOT NULL,
+    linkedby BIGINT UNSIGNED NOT NULL,
+    linked BIGINT NOT NULL,
+    UNIQUE INDEX sprint_guild (sprint, guild),
+    INDEX guild_channel (guild, channel)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;
\ No newline at end of file
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS tasks_dead (
+    id INTEGER PRIMARY KEY auto_increment,
+    task INTEGER NOT NULL,
+    time BIGINT NOT NULL,
+    type VARCHAR(255) NOT NULL,
+    object VARCHAR(255) NULL,
+    objectid INTEGER NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT NULL,
+    failed BIGINT NOT NULL
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;
\ No newline at end of file
@@ -0,0 +1,39 @@
+import interactions
+from models.channel import Channel
+from models.helper import Helper
+
+class Events(interactions.Extension):
+
+    def __init__(self, client: interactions.Client):
+        self.bot: interactions.Client = client
+        self.helper = Helper.instance()
+
+    @interactions.extension_listener(name="on_channel_create")
+    async def on_channel_create(self, channel: interactions.Channel):
+        """
+        Cache new channels, in case we post to them
+        :param channel:
+        :return:
+        """
+        Channel.store(channel)
+
+    @interactions.extension_listener(name="on_channel_update")
+    async def on_channel_update(self, *channels: interactions.Channel):
+        """
+        Replace the cached copy of a channel which has changed
+        :param channels: The updated channel, which some versions of the library send after the channel as it was before
+        :return:
+        """
+        Channel.store(channels[-1])
+
+    @interactions.extension_listener(name="on_channel_delete")
+    async def on_channel_delete(self, channel: interactions.Channel):
+        """
+        Stop caching channels which have been deleted
+        :param channel:
+        :return:
+        """
+        Channel.invalidate(channel.id)
+
+def setup(client):
+    Events(client)
@@ -163,18 +163,19 @@ class Utils(interactions.Extension):
             return await context.send('Your guild has disabled this command')
 
         user = User(context.author.id, context.guild_id, context)
+        snapshot = user.load_profile()
         profile = {
-            'lvlxp': user.get_xp_bar(),
-            'words': user.get_stat('total_words_written'),
-            'words_sprints': user.get_stat('sprints_words_written'),
-            'sprints_started': user.get_stat('sprints_started'),
-            'sprints_completed': user.get_stat('sprints_completed'),
-            'sprints_won': user.get_stat('sprints_won'),
-            'challenges_completed': user.get_stat('challenges_completed'),
-            'daily_goals_completed': user.get_stat('daily_goals_completed'),
-            'weekly_goals_completed': user.get_stat('weekly_goals_completed'),
-            'monthly_goals_completed': user.get_stat('monthly_goals_completed'),
-            'yearly_goals_completed': user.get_stat('yearly_goals_completed'),
+            'lvlxp': snapshot.get_xp_bar(),
+            'words': snapshot.get_stat('total_words_written'),
+            'words_sprints': snapshot.get_stat('sprints_words_written'),
+            'sprints_started': snapshot.get_stat('sprints_started'),
+            'sprints_completed': snapshot.get_stat('sprints_completed'),
+            'sprints_won': snapshot.get_stat('sprints_won'),
+            'challenges_completed': snapshot.get_stat('challenges_completed'),
+            'daily_goals_completed': snapshot.get_stat('daily_goals_completed'),
+            'weekly_goals_completed': snapshot.get_stat('weekly_goals_completed'),
+            'monthly_goals_completed': snapshot.get_stat('monthly_goals_completed'),
+            'yearly_goals_completed': snapshot.get_stat('yearly_goals_completed'),
         }
 
         fields = [
@@ -306,6 +307,10 @@ class Utils(interactions.Extension):
                             interactions.Choice(
                                 name="Sprint end delay (minutes)",
                                 value="sprint_delay_end"
+                            ),
+                            interactions.Choice(
+                                name="Sprint live leaderboard (1 = on, 0 = off)",
+                                value="sprint_leaderboard"
                             )
                         ],
                         required=True
@@ -353,6 +358,10 @@ class Utils(interactions.Extension):
             if setting == 'sprint_delay_end' and (not self.helper.is_number(value) or int(value) < 1):
                 return await context.send('Value must be a number, greater than 0')
 
+            # Sprint leaderboard.
+            elif setting == 'sprint_leaderboard' and value not in ['0', '1']:
+                return await context.send('Value must be 1 (on) or 0 (off)')
+
             # Enable/Disable commands.
             elif setting in ['disable', 'enable']:
                 if value not in Utils.COMMAND_LIST:
@@ -453,6 +462,10 @@ class Utils(interactions.Extension):
 
             # Everything is okay with validation, so update the setting.
             user.update_setting(setting, value)
+
+            # Changing timezone moves the user's goal resets to midnight in the new timezone.
+            if setting == 'timezone':
+                user.update_goal_resets()
             return await context.send(f"Updated your setting `{setting}` to `{value}`", ephemeral=True)
 
     @interactions.extension_command(
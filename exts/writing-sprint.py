@@ -3,6 +3,7 @@ from datetime import datetime
 from models.database import Database
 from models.guild import Guild
 from models.helper import Helper
+from models.leaderboard import Leaderboard
 from models.project import Project
 from models.sprint import Sprint
 from models.task import Task
@@ -97,6 +98,29 @@ class SprintCommand(interactions.Extension):
                     )
                 ]
             ),
+            interactions.Option(
+                name="share",
+                description="Get a code which other servers can use to take part in this sprint",
+                type=interactions.OptionType.SUB_COMMAND
+            ),
+            interactions.Option(
+                name="link",
+                description="Link this channel to a sprint in another server, so you can take part in it together",
+                type=interactions.OptionType.SUB_COMMAND,
+                options=[
+                    interactions.Option(
+                        name="code",
+                        description="The code the other server got from `/sprint share`",
+                        type=interactions.OptionType.STRING,
+                        required=True
+                    )
+                ]
+            ),
+            interactions.Option(
+                name="unlink",
+                description="Stop this channel taking part in another server's sprint, or stop sharing this server's sprint",
+                type=interactions.OptionType.SUB_COMMAND
+            ),
             interactions.Option(
                 name="purge",
                 description="Purge any users who asked for notifications but aren't in the server any more",
@@ -204,7 +228,7 @@ class SprintCommand(interactions.Extension):
         in_mins = kwargs.get('in') or None
         at_mins = kwargs.get('at') or None
 
-        sprint = Sprint(context.guild_id)
+        sprint = Sprint(context.guild_id, context.channel_id, self.bot)
 
         # Start a sprint
         if sub_command == 'for':
@@ -267,6 +291,15 @@ class SprintCommand(interactions.Extension):
         elif sub_command == 'purge':
             return await self.sprint_purge(context, user)
 
+        elif sub_command == 'share':
+            return await self.sprint_share(context, sprint, user)
+
+        elif sub_command == 'link':
+            return await self.sprint_link(context, sprint, user, kwargs.get('code'))
+
+        elif sub_command == 'unlink':
+            return await self.sprint_unlink(context, sprint, user)
+
         elif sub_command == 'end':
             return await self.sprint_end(context, sprint, user)
 
@@ -280,7 +313,7 @@ class SprintCommand(interactions.Extension):
         """
         # If there is no active sprint, show an error.
         if not sprint.exists():
-            await context.send(f"{user.get_mention()}, there is no sprint running on this server. Maybe you should start one? `/sprint for`")
+            await context.send(f"{user.get_mention()}, there is no sprint running in this channel. Maybe you should start one? `/sprint for`")
             return False
 
         # All okay.
@@ -354,6 +387,11 @@ class SprintCommand(interactions.Extension):
         await context.send(f"{user.get_mention()}, you updated your word count to: **{wordcount}**. Total words written in this sprint: **{written}**.")
         context.deferred = False
 
+        # Update the live leaderboard, if any of the guilds taking part have it turned on.
+        board = Leaderboard.get(sprint, self.bot)
+        if board is not None:
+            board.set(user.id, written)
+
         if sprint.is_finished() and sprint.is_declaration_finished():
             Task.cancel('sprint', sprint.id)
             await sprint.complete_sprint(context=context)
@@ -508,11 +546,11 @@ class SprintCommand(interactions.Extension):
 
             # Normal sprint.
             if type is None:
-                sprint.join(user.id, start = initial, type = type, project_id = project_id)
+                sprint.join(user.id, start = initial, type = type, project_id = project_id, guild_id = context.guild_id)
                 message = f"you have joined the sprint with **{initial}** words."
 
             elif type == Sprint.TYPE_NO_WORDCOUNT:
-                sprint.join(user.id, start = 0, type = type, project_id = project_id)
+                sprint.join(user.id, start = 0, type = type, project_id = project_id, guild_id = context.guild_id)
                 message = f"you are now sprinting without a word count. You will not be included in the final tallies."
 
         # If they chose a project, add that to the message.
@@ -560,6 +598,95 @@ class SprintCommand(interactions.Extension):
 
         await context.send(f"{user.get_mention()}, {message}")
 
+    async def sprint_share(self, context, sprint, user):
+        """
+        Share the sprint in this channel, so other servers can link to it
+        :param context:
+        :param sprint:
+        :param user:
+        :return:
+        """
+        if not await self.sprint_common_checks(context, sprint, user):
+            return
+
+        # Only the server which started the sprint can share it, and only if they could cancel it.
+        if str(context.guild_id) != str(sprint.guild):
+            return await context.send(f"{user.get_mention()}, this sprint was started in another server, so only they can share it")
+
+        if int(sprint.createdby) != int(user.id) and not (context.author.permissions & interactions.Permissions.MANAGE_MESSAGES):
+            return await context.send(f"{user.get_mention()}, you do not have permission to share this sprint")
+
+        code = sprint.share()
+        return await context.send(f"Other servers can now take part in this sprint, by running `/sprint link {code}` in one of their channels. Use `/sprint unlink` to stop sharing it.")
+
+    async def sprint_link(self, context, sprint, user, code: str):
+        """
+        Link this channel to a sprint running in another server, making it a global sprint everyone here can join
+        :param context:
+        :param sprint: The sprint in this channel, if there is one
+        :param user:
+        :param code: The code the sprint was shared with
+        :return:
+        """
+        # If they do not have permission to link this channel, display an error.
+        if not context.author.permissions & interactions.Permissions.MANAGE_MESSAGES:
+            return await context.send(f"{user.get_mention()}, you do not have permission to link this channel to a sprint")
+
+        # There can only be one sprint in a channel.
+        if sprint.exists():
+            return await context.send(f"{user.get_mention()}, there is already a sprint running here. Please wait until it has finished before linking to another one.")
+
+        target = Sprint.get_by_code(code.strip())
+        if target is None or target.is_finished():
+            return await context.send(f"{user.get_mention()}, there is no sprint being shared with that code, or it has already finished.")
+
+        # Each server takes part through one channel.
+        if str(context.guild_id) in [guild for guild, channel in target.get_channels()]:
+            return await context.send(f"{user.get_mention()}, this server is already taking part in that sprint.")
+
+        target.set_bot(self.bot)
+        if not target.link(context.guild_id, context.channel_id, user.id):
+            return await context.send(f"{user.get_mention()}, this server is already taking part in that sprint.")
+
+        # Let everyone here know, and mention anyone in this server who wants to be notified about new sprints.
+        message = [f"**This channel is now taking part in a global sprint**\nIt will run for {target.length} minute(s). Use `/sprint join` to join it."]
+        notify_users = target.get_notify_users(context.guild_id)
+        if notify_users:
+            message += ["\n:bell: ", notify_users]
+
+        return await target.notify(message, context, channel=context.channel_id)
+
+    async def sprint_unlink(self, context, sprint, user):
+        """
+        Remove this channel from another server's sprint, or stop sharing this server's sprint with any others
+        :param context:
+        :param sprint:
+        :param user:
+        :return:
+        """
+        if not await self.sprint_common_checks(context, sprint, user):
+            return
+
+        # In the server which started it, this removes every linked channel and stops it being shared.
+        if str(context.guild_id) == str(sprint.guild):
+
+            if int(sprint.createdby) != int(user.id) and not (context.author.permissions & interactions.Permissions.MANAGE_MESSAGES):
+                return await context.send(f"{user.get_mention()}, you do not have permission to stop sharing this sprint")
+
+            # Let the linked channels know, before they are removed.
+            links = sprint.get_channels()[1:]
+            await sprint.broadcast(lambda guild: ["**This channel has been unlinked from the sprint**\nThe server running it has stopped sharing it."], channels=links)
+
+            sprint.unlink()
+            return await context.send(f"{user.get_mention()}, this sprint is no longer shared with any other servers.")
+
+        # Otherwise, this only removes this server's channel, and the users who joined from it.
+        if not context.author.permissions & interactions.Permissions.MANAGE_MESSAGES:
+            return await context.send(f"{user.get_mention()}, you do not have permission to unlink this channel from the sprint")
+
+        removed = sprint.unlink(context.guild_id)
+        return await context.send(f"This channel is no longer taking part in the sprint, and {removed} user(s) from this server have been removed from it.")
+
     async def sprint_pb(self, context, sprint, user):
         """
         Check the user's personal best WPM from sprints
@@ -677,6 +804,10 @@ class SprintCommand(interactions.Extension):
         if int(sprint.createdby) != int(user.id) and not (context.author.permissions & interactions.Permissions.MANAGE_MESSAGES):
             return await context.send(f"{user.get_mention()}, you do not have permission to end this sprint")
 
+        # Only the server which started a global sprint can end it.
+        if str(context.guild_id) != str(sprint.guild):
+            return await context.send(f"{user.get_mention()}, this sprint was started in another server, so only they can end it")
+
         # If the sprint hasn't started yet, display that generic error.
         if not await self.sprint_common_start_check(context, sprint, user):
             return
@@ -707,15 +838,19 @@ class SprintCommand(interactions.Extension):
         if int(sprint.createdby) != int(user.id) and not (context.author.permissions & interactions.Permissions.MANAGE_MESSAGES):
             return await context.send(f"{user.get_mention()}, you do not have permission to cancel this sprint")
 
-        # Get the users sprinting and create an array of mentions
-        users = sprint.get_users()
-        notify = sprint.get_notifications(users)
+        # Only the server which started a global sprint can cancel it.
+        if str(context.guild_id) != str(sprint.guild):
+            return await context.send(f"{user.get_mention()}, this sprint was started in another server, so only they can cancel it")
+
+        # Get the users sprinting and the channels taking part, so we can mention them.
+        users = sprint.get_users_by_guild()
+        channels = sprint.get_channels()
 
         # Cancel the sprint
         sprint.cancel(context)
 
         # Display the cancellation message
-        return await context.send('**Sprint has been cancelled**: ' + ', '.join(notify))
+        return await sprint.broadcast(lambda guild: ['**Sprint has been cancelled**: ', users.get(guild, [])], context, channels=channels)
 
 
     async def sprint_start(self, context, sprint, user, length: int, type: str = None, value: int = None):
@@ -66,8 +66,7 @@ class WroteCommand(interactions.Extension):
             total = int(written_stat) + int(amount)
             message = f"added {amount} words to your project **{user_project.name} ({user_project.shortname})** ({user_project.words}) [{total}]"
 
-        user.add_stat('total_words_written', amount)
-        total = user.get_stat('total_words_written')
+        total = user.add_stat('total_words_written', amount)
 
         # Update any goals they are running.
         await user.add_to_goals(amount)
@@ -0,0 +1,281 @@
+import aiomysql, asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from models.database import build_get, build_insert, build_upsert, build_delete, build_update
+from models.helper import Helper
+from models.singleton import Singleton
+from config import DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT
+
+# The auto increment id of the last record inserted. Each query has its own cursor, so this is kept per coroutine
+# instead of on a shared cursor, so last_insert_id() can't return an id inserted by another one.
+LAST_INSERT_ID = ContextVar('last_insert_id', default=None)
+
+class AsyncQueries:
+    """
+    The query methods of AsyncDatabase, which are also available on the transactions it starts.
+    They are the same as the ones on Database, just awaitable.
+    """
+
+    def connection(self):
+        """
+        Get a connection to run a query on, as an async context manager
+        :return:
+        """
+        raise NotImplementedError
+
+    async def query(self, sql, params, fetch=None):
+        """
+        Run a query on its own cursor, counting it
+        :param sql:
+        :param params:
+        :param fetch: 'one' or 'all' to return the results, otherwise the number of affected rows is returned
+        :return:
+        """
+        async with self.connection() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                AsyncDatabase.instance().queries += 1
+                result = await cursor.execute(sql, params)
+                LAST_INSERT_ID.set(cursor.lastrowid)
+
+                if fetch == 'one':
+                    return await cursor.fetchone()
+                elif fetch == 'all':
+                    return await cursor.fetchall()
+
+                return result
+
+    async def get(self, table, where=None, fields=['*'], sort=None):
+        """
+        Get an individual record
+        :param table:
+        :param where:
+        :param fields:
+        :param sort:
+        :return:
+        """
+        return await self.query(*build_get(table, where, fields, sort), fetch='one')
+
+    async def get_sql(self, sql, params):
+        """
+        Get an individual record using raw SQL
+        :param sql:
+        :param params:
+        :return:
+        """
+        return await self.query(sql, params, fetch='one')
+
+    async def get_all(self, table, where=None, fields=['*'], sort=None, limit=None):
+        """
+        Get multiple records
+        :param table:
+        :param where:
+        :param fields:
+        :param sort:
+        :param limit:
+        :return:
+        """
+        return await self.query(*build_get(table, where, fields, sort, limit), fetch='all')
+
+    async def get_all_sql(self, sql, params):
+        """
+        Get multiple records using raw SQL
+        :param sql:
+        :param params:
+        :return:
+        """
+        return await self.query(sql, params, fetch='all')
+
+    async def insert(self, table, params):
+        """
+        Insert data into the database
+        :param table:
+        :param params:
+        :return:
+        """
+        return await self.query(*build_insert(table, params))
+
+    async def upsert(self, table, rows, fields, increment=False):
+        """
+        Insert record(s) into the database, or update the existing ones if they already exist
+        :param table:
+        :param rows:
+        :param fields:
+        :param increment:
+        :return:
+        """
+        return await self.query(*build_upsert(table, rows, fields, increment))
+
+    def last_insert_id(self):
+        """
+        Get the auto increment id of the last record inserted by this coroutine
+        :return:
+        """
+        return LAST_INSERT_ID.get()
+
+    async def delete(self, table, params):
+        """
+        Delete record(s) from the database
+        :param table:
+        :param params:
+        :return:
+        """
+        return await self.query(*build_delete(table, params))
+
+    async def update(self, table, params, where=None):
+        """
+        Update record(s) in the database
+        :param table:
+        :param params:
+        :param where:
+        :return:
+        """
+        return await self.query(*build_update(table, params, where))
+
+    async def execute(self, sql, params):
+        """
+        Execute some raw SQL
+        :param sql:
+        :param params:
+        :return:
+        """
+        return await self.query(sql, params)
+
+class AsyncTransaction(AsyncQueries):
+    """
+    The queries run on an AsyncTransaction all go through the one pooled connection the transaction was started on.
+    """
+
+    def __init__(self, connection):
+        """
+        Instantiate the object
+        :param connection:
+        """
+        self.__connection = connection
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Get the transaction's connection
+        :return:
+        """
+        yield self.__connection
+
+@Singleton
+class AsyncDatabase(AsyncQueries):
+    """
+    Non-blocking, pooled alternative to the Database class.
+    It has the same methods as Database, just awaitable, so a model can be moved over by swapping `Database.instance()`
+    for `AsyncDatabase.instance()` and awaiting its queries. Both classes can be used side by side while the models are
+    being moved over.
+    """
+
+    def __init__(self):
+        """
+        Create the AsyncDatabase instance. The pool itself is created on first use, as it needs the event loop.
+        """
+        self.__helper = Helper.instance()
+        self.__pool = None
+        self.__lock = None
+
+        # How many queries have been run, for benchmarking.
+        self.queries = 0
+
+    async def connect(self):
+        """
+        Create the connection pool, if it hasn't been created yet
+        :return: aiomysql.Pool
+        """
+        if self.__pool is not None:
+            return self.__pool
+
+        # Lock this, so that lots of coroutines hitting the database at once on boot only create one pool between them.
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+
+        async with self.__lock:
+            if self.__pool is None:
+                self.__pool = await aiomysql.create_pool(
+                    host=DB_HOST,
+                    user=DB_USER,
+                    password=DB_PASS,
+                    db=DB_NAME,
+                    minsize=DB_POOL_MIN,
+                    maxsize=DB_POOL_MAX,
+                    autocommit=True
+                )
+                self.__helper.log(f"[DB] Created connection pool ({DB_POOL_MIN}-{DB_POOL_MAX} connections)")
+
+        return self.__pool
+
+    async def close(self):
+        """
+        Close all the connections in the pool
+        :return:
+        """
+        if self.__pool is not None:
+            self.__pool.close()
+            await self.__pool.wait_closed()
+            self.__pool = None
+            self.__lock = None
+
+    async def acquire(self):
+        """
+        Acquire a connection from the pool, waiting at most DB_POOL_TIMEOUT seconds for one to become free
+        :return:
+        """
+        pool = await self.connect()
+        try:
+            return await asyncio.wait_for(pool.acquire(), DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.__helper.error(f"[DB] Timed out after {DB_POOL_TIMEOUT}s waiting for a pooled connection")
+            raise
+
+    async def release(self, connection):
+        """
+        Return a connection to the pool
+        :param connection:
+        :return:
+        """
+        pool = await self.connect()
+        pool.release(connection)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Get a connection from the pool for the length of the `async with` block
+        :return:
+        """
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            await self.release(connection)
+
+    @asynccontextmanager
+    async def cursor(self):
+        """
+        Get a DictCursor on its own pooled connection, so each coroutine has its own cursor.
+        Usage: `async with db.cursor() as cursor:`
+        :return:
+        """
+        async with self.connection() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                yield cursor
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Run the queries inside the `async with` block in a single transaction, rolling it back if any of them fail.
+        Like Database.transaction(), this yields an object with all the query methods, which run on the transaction's connection.
+        Usage: `async with db.transaction() as transaction:`
+        :return: AsyncTransaction
+        """
+        async with self.connection() as connection:
+            await connection.begin()
+            try:
+                yield AsyncTransaction(connection)
+            except:
+                await connection.rollback()
+                raise
+            else:
+                await connection.commit()
@@ -0,0 +1,199 @@
+import asyncio, json, os, socket, struct, uuid
+from urllib.parse import urlparse
+from models.helper import Helper
+from models.singleton import Singleton
+from config import CACHE_BUS
+
+class Transport:
+    """
+    Interface for sending invalidation messages between the bot's processes.
+    Anything which can broadcast a message to every process and pass on the ones it receives can implement it, e.g. a
+    Redis pub/sub channel would publish in send() and subscribe in start().
+    """
+
+    async def start(self, receive):
+        """
+        Start listening for messages from the other processes
+        :param receive: function(bytes) to call with each message received
+        :return:
+        """
+        raise NotImplementedError
+
+    def send(self, message):
+        """
+        Send a message to all of the processes, including this one
+        :param message: bytes
+        :return:
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Stop listening and free up any resources
+        :return:
+        """
+        pass
+
+class LocalTransport(Transport):
+    """
+    Transport for when the bot is running as a single process, so there is nothing to send messages to.
+    """
+
+    async def start(self, receive):
+        pass
+
+    def send(self, message):
+        pass
+
+class MulticastTransport(Transport):
+    """
+    Transport which sends messages over UDP multicast, for running multiple processes on the same host (or LAN).
+    """
+
+    def __init__(self, group, port):
+        """
+        Instantiate the object
+        :param group: Multicast group address, e.g. 239.255.42.99
+        :param port:
+        """
+        self.group = group
+        self.port = port
+        self.__sender = None
+        self.__listener = None
+
+    async def start(self, receive):
+        # Several processes on the same host all need to bind to the same port.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+
+        membership = struct.pack('4sl', socket.inet_aton(self.group), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setblocking(False)
+
+        protocol = type('BusProtocol', (asyncio.DatagramProtocol,), {
+            'datagram_received': lambda self, data, address: receive(data)
+        })
+        self.__listener, _ = await asyncio.get_event_loop().create_datagram_endpoint(protocol, sock=sock)
+
+    def send(self, message):
+        if self.__sender is None:
+            self.__sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self.__sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self.__sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        self.__sender.sendto(message, (self.group, self.port))
+
+    def close(self):
+        if self.__listener is not None:
+            self.__listener.close()
+        if self.__sender is not None:
+            self.__sender.close()
+
+@Singleton
+class Bus:
+    """
+    Invalidation bus, which keeps the in-memory caches of all the bot's processes in step.
+    Caches subscribe to it by name. When a model changes something which is cached, it publishes the name of the cache
+    and the key which changed, and every process (including this one) removes that key from its copy of the cache.
+    The transport is set by the CACHE_BUS environment variable: `local` (the default), or `multicast://group:port`.
+    """
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__helper = Helper.instance()
+        self.__subscribers = {}
+        self.__transport = Bus.get_transport(CACHE_BUS)
+
+        # Unique ID for this process, so we can ignore our own messages when they come back to us.
+        self.__origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def get_transport(url):
+        """
+        Create the transport described by a CACHE_BUS url
+        :param url:
+        :return: Transport
+        """
+        parsed = urlparse(url or 'local')
+        if parsed.scheme == 'multicast':
+            return MulticastTransport(parsed.hostname, parsed.port)
+        elif (parsed.scheme or parsed.path) == 'local':
+            return LocalTransport()
+        else:
+            raise ValueError(f"Invalid CACHE_BUS transport: {url}")
+
+    def subscribe(self, name, callback):
+        """
+        Subscribe to the invalidations for a cache
+        :param name: Name of the cache
+        :param callback: function(key) to call when a key is invalidated. The key is None if the whole cache is.
+        :return:
+        """
+        self.__subscribers.setdefault(name, []).append(callback)
+
+    def publish(self, name, key=None, local=True):
+        """
+        Invalidate a key in a cache, in this process and all the others
+        :param name: Name of the cache
+        :param key: The key to invalidate, or None for the whole cache
+        :param local: False if this process has already updated its own copy, and only the others need telling
+        :return:
+        """
+        if local:
+            self.dispatch(name, key)
+
+        try:
+            self.__transport.send(json.dumps({'origin': self.__origin, 'name': name, 'key': key}).encode())
+        except OSError as e:
+            self.__helper.error(f"[BUS] Failed to publish invalidation of {name} {key}: {e}")
+
+    def dispatch(self, name, key):
+        """
+        Pass an invalidation on to the subscribers in this process
+        :param name:
+        :param key:
+        :return:
+        """
+        for callback in self.__subscribers.get(name, []):
+            callback(key)
+
+    def receive(self, data):
+        """
+        Handle a message received from another process
+        :param data:
+        :return:
+        """
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return self.__helper.error(f"[BUS] Invalid message received: {data}")
+
+        if message.get('origin') == self.__origin:
+            return
+
+        # JSON turns tuple keys into lists, so turn them back.
+        key = message.get('key')
+        if isinstance(key, list):
+            key = tuple(key)
+
+        self.dispatch(message.get('name'), key)
+
+    async def start(self):
+        """
+        Start listening for invalidations from the other processes
+        :return:
+        """
+        await self.__transport.start(self.receive)
+        self.__helper.log(f"[BUS] Listening for cache invalidations ({type(self.__transport).__name__})")
+
+    def close(self):
+        """
+        Stop listening
+        :return:
+        """
+        self.__transport.close()
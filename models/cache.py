@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from models.bus import Bus
+
+class Cache:
+    """
+    Simple in-memory key => value cache.
+    Entries expire after `ttl` seconds, and if `maxsize` is set, the least recently used entries are evicted once it is full.
+    Every cache subscribes to the Bus under its name, so models can invalidate its entries in all of the bot's processes.
+    """
+
+    def __init__(self, name, ttl=None, maxsize=None):
+        """
+        Create the cache
+        :param name: Name of the cache, which invalidations are published under
+        :param ttl: How many seconds entries are kept for, or None to keep them until they are evicted or invalidated
+        :param maxsize: The maximum number of entries, or None for no limit
+        """
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        # Dictionary of key => (expires, value), in least to most recently used order.
+        self.__entries = OrderedDict()
+
+        Bus.instance().subscribe(name, self.invalidate)
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache
+        :param key:
+        :param default: Value to return if the key isn't cached or has expired
+        :return:
+        """
+        entry = self.__entries.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires is not None and expires <= time.time():
+            del self.__entries[key]
+            return default
+
+        self.__entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value in the cache
+        :param key:
+        :param value:
+        :return:
+        """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self.__entries[key] = (expires, value)
+        self.__entries.move_to_end(key)
+
+        if self.maxsize is not None:
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove a value from the cache
+        :param key:
+        :return:
+        """
+        self.__entries.pop(key, None)
+
+    def invalidate(self, key=None):
+        """
+        Handle an invalidation from the Bus
+        :param key: The key to remove, or None to clear the whole cache
+        :return:
+        """
+        if key is None:
+            self.clear()
+        else:
+            self.delete(key)
+
+    def clear(self):
+        """
+        Remove everything from the cache
+        :return:
+        """
+        self.__entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,48 @@
+import interactions
+from models.bus import Bus
+from models.cache import Cache
+from config import CHANNEL_CACHE_TTL, CHANNEL_CACHE_SIZE
+
+class Channel:
+    """
+    Looks up the Discord channels the bot posts to without a context, e.g. from scheduled tasks.
+    Channel objects are cached, so that posting to the same channel again doesn't need another REST request. The cache
+    is also filled and refreshed from the gateway's channel events, and channels are removed from it when deleted.
+    """
+
+    # Cache of channel id => interactions.Channel.
+    CACHE = Cache('channels', ttl=CHANNEL_CACHE_TTL, maxsize=CHANNEL_CACHE_SIZE)
+
+    @staticmethod
+    async def get(bot, id):
+        """
+        Get a channel object, from the cache if we have it, or from the API otherwise
+        :param bot:
+        :param id:
+        :return: interactions.Channel
+        """
+        channel = Channel.CACHE.get(int(id))
+        if channel is None:
+            data = await bot._http.get_channel(int(id))
+            channel = interactions.Channel(**data, _client=bot._http)
+            Channel.CACHE.set(int(id), channel)
+
+        return channel
+
+    @staticmethod
+    def store(channel):
+        """
+        Store a channel object we have been sent, e.g. by a gateway event
+        :param channel: interactions.Channel
+        :return:
+        """
+        Channel.CACHE.set(int(channel.id), channel)
+
+    @staticmethod
+    def invalidate(id):
+        """
+        Remove a channel from the cache, in this process and all the others
+        :param id:
+        :return:
+        """
+        Bus.instance().publish(Channel.CACHE.name, int(id))
@@ -1,7 +1,177 @@
-import sys, os, pymysql, warnings
+import hashlib, sys, os, pymysql, warnings
+from contextlib import contextmanager
 from models.singleton import Singleton
 from config import DB_HOST, DB_USER, DB_PASS, DB_NAME
 
+def build_get(table, where=None, fields=['*'], sort=None, limit=None):
+    """
+    Build a select SQL query
+    These builders are shared by Database and AsyncDatabase, so both backends generate identical SQL.
+    :param table:
+    :param where:
+    :param fields:
+    :param sort:
+    :param limit:
+    :return: tuple of (sql, params)
+    """
+
+    params = []
+
+    sql = 'SELECT ' + ', '.join(fields) + ' ' \
+          'FROM ' + table + ' '
+
+    # Did we specify some WHERE clauses?
+    if where is not None:
+
+        sql += 'WHERE '
+
+        for field, value in where.items():
+            sql += field + ' = %s AND '
+            params.append(value)
+
+        # Remove the last 'AND '
+        sql = sql[:-4]
+
+    # Did we specify some sorting?
+    if sort is not None:
+        sql += ' ORDER BY ' + ', '.join(sort)
+
+    # Is there a limit?
+    if limit is not None:
+        sql += ' LIMIT ' + str(limit)
+
+    return sql, params
+
+def build_insert(table, params):
+    """
+    Build an insert SQL query
+    :param table:
+    :param params:
+    :return: tuple of (sql, params)
+    """
+    # Create param placeholders to be used in the query
+    placeholders = ['%s'] * len(params.values())
+
+    sql = 'INSERT INTO ' + table + ' '
+    sql += '(' + ','.join(params.keys()) + ') '
+    sql += 'VALUES '
+    sql += '(' + ','.join(placeholders) + ') '
+
+    return sql, list(params.values())
+
+def build_upsert(table, rows, fields, increment=False):
+    """
+    Build an insert SQL query which updates the existing record instead, if the insert would break a unique key
+    :param table:
+    :param rows: Dictionary of params, or a list of them to insert multiple records
+    :param fields: The fields to update on the existing record
+    :param increment: If True, the new values are added to the existing ones, instead of replacing them
+    :return: tuple of (sql, params)
+    """
+    if isinstance(rows, dict):
+        rows = [rows]
+
+    # Create param placeholders to be used in the query
+    columns = list(rows[0].keys())
+    placeholders = '(' + ','.join(['%s'] * len(columns)) + ')'
+
+    sql = 'INSERT INTO ' + table + ' '
+    sql += '(' + ','.join(columns) + ') '
+    sql += 'VALUES '
+    sql += ','.join([placeholders] * len(rows)) + ' '
+    sql += 'ON DUPLICATE KEY UPDATE '
+
+    if increment:
+        sql += ', '.join(field + ' = ' + field + ' + VALUES(' + field + ')' for field in fields)
+    else:
+        sql += ', '.join(field + ' = VALUES(' + field + ')' for field in fields)
+
+    sql_params = []
+    for row in rows:
+        sql_params += [row[column] for column in columns]
+
+    return sql, sql_params
+
+def build_case(field, values):
+    """
+    Build a CASE expression which maps each value of a field to a different result, for updating many records with one query
+    E.g. {1: 10, 2: 20} => CASE field WHEN 1 THEN 10 WHEN 2 THEN 20 ELSE 0 END
+    :param field:
+    :param values: Dictionary of field value => result
+    :return: tuple of (sql, params)
+    """
+    params = []
+    sql = 'CASE ' + field + ' '
+
+    for value, result in values.items():
+        sql += 'WHEN %s THEN %s '
+        params += [value, result]
+
+    sql += 'ELSE 0 END'
+
+    return sql, params
+
+def build_in(values):
+    """
+    Build the placeholders for an IN clause
+    :param values:
+    :return: str
+    """
+    return '(' + ', '.join(['%s'] * len(values)) + ')'
+
+def build_delete(table, params):
+    """
+    Build a delete SQL query
+    :param table:
+    :param params:
+    :return: tuple of (sql, params)
+    """
+
+    sql_params = []
+    sql = 'DELETE FROM ' + table + ' WHERE '
+
+    for field, value in params.items():
+        sql += field + ' = %s AND '
+        sql_params.append(value)
+
+    # Remove the last 'AND '
+    sql = sql[:-4]
+
+    return sql, sql_params
+
+def build_update(table, params, where=None):
+    """
+    Build an update SQL query
+    :param table:
+    :param params:
+    :param where:
+    :return: tuple of (sql, params)
+    """
+
+    sql_params = []
+    sql = 'UPDATE ' + table + ' SET '
+
+    # Set values
+    for field, value in params.items():
+        sql += field + ' = %s, '
+        sql_params.append(value)
+
+    # Remove the last ', '
+    sql = sql[:-2]
+
+    # Where clauses
+    if where is not None:
+        sql += ' WHERE '
+
+        for field, value in where.items():
+            sql += field + ' = %s AND '
+            sql_params.append(value)
+
+        # Remove the last 'AND '
+        sql = sql[:-4]
+
+    return sql, sql_params
+
 @Singleton
 class Database:
 
@@ -17,14 +187,17 @@ class Database:
         self.connection = pymysql.connect(
             host=DB_HOST,
             user=DB_USER,
-            passwd=DB_PASS,
-            db=DB_NAME,
+            password=DB_PASS,
+            database=DB_NAME,
             autocommit=True
         )
 
         # Set the cursor to be used, with DictCursor so we can refer to results by their keys.
         self.cursor = self.connection.cursor(pymysql.cursors.DictCursor)
 
+        # How many queries have been run, for benchmarking.
+        self.queries = 0
+
     def __del__(self):
         """
         Close the connection
@@ -60,116 +233,70 @@ class Database:
             self.connection.commit()
             return True
 
-    def __build_get(self, table, where=None, fields=['*'], sort=None, limit=None):
+    def get_schema_fingerprint(self):
         """
-        Build and run a select SQL query
-        :param table:
-        :param where:
-        :param fields:
-        :param sort:
-        :param limit:
-        :return:
+        Get a hash of all the install and update files, which changes whenever the schema does
+        :return: str
         """
+        fingerprint = hashlib.sha1()
 
-        params = []
-
-        sql = 'SELECT ' + ', '.join(fields) + ' ' \
-              'FROM ' + table + ' '
-
-        # Did we specify some WHERE clauses?
-        if where is not None:
-
-            sql += 'WHERE '
-
-            for field, value in where.items():
-                sql += field + ' = %s AND '
-                params.append(value)
-
-            # Remove the last 'AND '
-            sql = sql[:-4]
+        for directory in ['install', 'updates']:
+            path = self.__path + '/../data/' + directory + '/'
+            for filename in sorted(os.listdir(path)):
+                fingerprint.update(filename.encode())
+                with open(os.path.join(path, filename), 'rb') as file:
+                    fingerprint.update(file.read())
 
-        # Did we specify some sorting?
-        if sort is not None:
-            sql += ' ORDER BY ' + ', '.join(sort)
+        return fingerprint.hexdigest()
 
-        # Is there a limit?
-        if limit is not None:
-            sql += ' LIMIT ' + str(limit)
+    def is_installed(self):
+        """
+        Check if the stored schema fingerprint matches the current one, in which case we can skip installing and updating
+        :return: bool
+        """
+        try:
+            record = self.get('bot_settings', {'setting': 'schema_fingerprint'})
+        except pymysql.err.ProgrammingError:
+            # The bot_settings table doesn't exist yet, so this must be a fresh database.
+            return False
 
-        self.cursor.execute(sql, params)
+        return record is not None and record['value'] == self.get_schema_fingerprint()
 
-    def __build_insert(self, table, params):
+    def set_installed(self):
         """
-        Build and run an insert SQL query
-        :param table:
-        :param params:
+        Store the current schema fingerprint, once the tables have been installed and updated
         :return:
         """
-        # Create param placeholders to be used in the query
-        placeholders = ['%s'] * len(params.values())
-
-        sql = 'INSERT INTO ' + table + ' '
-        sql += '(' + ','.join(params.keys()) + ') '
-        sql += 'VALUES '
-        sql += '(' + ','.join(placeholders) + ') '
-
-        sql_params = list(params.values())
-        self.cursor.execute(sql, sql_params)
+        fingerprint = self.get_schema_fingerprint()
+        if self.get('bot_settings', {'setting': 'schema_fingerprint'}):
+            return self.update('bot_settings', {'value': fingerprint}, {'setting': 'schema_fingerprint'})
+        else:
+            return self.insert('bot_settings', {'setting': 'schema_fingerprint', 'value': fingerprint})
 
-    def __build_delete(self, table, params):
+    def __execute(self, sql, params):
         """
-        Build and run a delete SQL query
-        :param table:
+        Execute a query on the cursor, counting it
+        :param sql:
         :param params:
         :return:
         """
+        self.queries += 1
+        return self.cursor.execute(sql, params)
 
-        sql_params = []
-        sql = 'DELETE FROM ' + table + ' WHERE '
-
-        for field, value in params.items():
-            sql += field + ' = %s AND '
-            sql_params.append(value)
-
-        # Remove the last 'AND '
-        sql = sql[:-4]
-
-        # Execute the query
-        self.cursor.execute(sql, sql_params)
-
-    def __build_update(self, table, params, where=None):
+    @contextmanager
+    def transaction(self):
         """
-        Build an run an update SQL query
-        :param table:
-        :param params:
-        :param where:
+        Run the queries inside the `with` block in a single transaction, rolling it back if any of them fail
         :return:
         """
-
-        sql_params = []
-        sql = 'UPDATE ' + table + ' SET '
-
-        # Set values
-        for field, value in params.items():
-            sql += field + ' = %s, '
-            sql_params.append(value)
-
-        # Remove the last ', '
-        sql = sql[:-2]
-
-        # Where clauses
-        if where is not None:
-            sql += ' WHERE '
-
-            for field, value in where.items():
-                sql += field + ' = %s AND '
-                sql_params.append(value)
-
-            # Remove the last 'AND '
-            sql = sql[:-4]
-
-        # Execute the query
-        self.cursor.execute(sql, sql_params)
+        self.connection.begin()
+        try:
+            yield self
+        except:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
 
     def get(self, table, where=None, fields=['*'], sort=None):
         """
@@ -180,7 +307,7 @@ class Database:
         :param sort:
         :return:
         """
-        self.__build_get(table, where, fields, sort)
+        self.__execute(*build_get(table, where, fields, sort))
         return self.cursor.fetchone()
 
     def get_sql(self, sql, params):
@@ -190,7 +317,7 @@ class Database:
         :param params:
         :return:
         """
-        self.cursor.execute(sql, params)
+        self.__execute(sql, params)
         return self.cursor.fetchone()
 
     def get_all(self, table, where=None, fields=['*'], sort=None, limit=None):
@@ -203,7 +330,7 @@ class Database:
         :param limit:
         :return:
         """
-        self.__build_get(table, where, fields, sort, limit)
+        self.__execute(*build_get(table, where, fields, sort, limit))
         return self.cursor.fetchall()
 
     def get_all_sql(self, sql, params):
@@ -213,7 +340,7 @@ class Database:
         :param params:
         :return:
         """
-        self.cursor.execute(sql, params)
+        self.__execute(sql, params)
         return self.cursor.fetchall()
 
     def insert(self, table, params):
@@ -223,9 +350,28 @@ class Database:
         :param params:
         :return:
         """
-        self.__build_insert(table, params)
+        self.__execute(*build_insert(table, params))
+        return self.cursor.rowcount
+
+    def upsert(self, table, rows, fields, increment=False):
+        """
+        Insert record(s) into the database, or update the existing ones if they already exist
+        :param table:
+        :param rows:
+        :param fields:
+        :param increment:
+        :return:
+        """
+        self.__execute(*build_upsert(table, rows, fields, increment))
         return self.cursor.rowcount
 
+    def last_insert_id(self):
+        """
+        Get the auto increment id of the last record inserted
+        :return:
+        """
+        return self.cursor.lastrowid
+
     def delete(self, table, params):
         """
         Delete record(s) from the database
@@ -233,7 +379,7 @@ class Database:
         :param params:
         :return:
         """
-        self.__build_delete(table, params)
+        self.__execute(*build_delete(table, params))
         return self.cursor.rowcount
 
     def update(self, table, params, where=None):
@@ -244,7 +390,7 @@ class Database:
         :param where:
         :return:
         """
-        self.__build_update(table, params, where)
+        self.__execute(*build_update(table, params, where))
         return self.cursor.rowcount
 
     def execute(self, sql, params):
@@ -254,4 +400,4 @@ class Database:
         :param params:
         :return:
         """
-        return self.cursor.execute(sql, params)
\ No newline at end of file
+        return self.__execute(sql, params)
\ No newline at end of file
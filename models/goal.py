@@ -1,12 +1,22 @@
 import pytz, time
-from models.database import Database
+from models.database import Database, build_case, build_in
 from models.helper import Helper
-from models.user import User
+from models.task import Task, task_handler
 
 class Goal:
 
-    # How many seconds between each check for goal resets. (30 mins).
-    TASK_RESET_LOOP_TIME = 1800
+    # The reset task is a single task, scheduled for the next time any goal is due to reset.
+    TASK_RESET_OBJECT_ID = 0
+
+    # Join a goal to its user's timezone setting, and the timezone to use for it (defaulting to UTC if they haven't set one).
+    RESET_JOIN = "LEFT JOIN user_settings s ON s.user = g.user AND s.setting = 'timezone' AND s.guild IS NULL"
+    RESET_TIMEZONE = "COALESCE(NULLIF(s.value, ''), 'UTC')"
+
+    # How many goals to reset with each INSERT ... SELECT and UPDATE, to keep the size of the queries down.
+    RESET_BATCH_SIZE = 1000
+
+    # The soonest the reset task is scheduled for, in seconds from now, so goals which couldn't be reset don't make it run again straight away.
+    RESET_MIN_DELAY = 60
 
     def __init__(self):
         """
@@ -15,38 +25,140 @@ class Goal:
         self.__db = Database.instance()
         self.__helper = Helper.instance()
 
-    async def task_reset(self, bot):
+    @staticmethod
+    @task_handler('goal', 'reset')
+    async def task_reset(bot, object_id):
         """
-        The scheduled task to reset user goals at midnight
+        The scheduled task to reset user goals at midnight.
+        The due goals and their users' timezones are loaded in one query. They are grouped by timezone and goal type, so
+        the next reset time and the history date only need calculating once per group. Then the history is written and
+        the goals reset by id, in batches, all inside one transaction.
         :param bot:
+        :param object_id:
         :return:
         """
-        # Find all the user_goal records which are due a reset
+        db = Database.instance()
+        helper = Helper.instance()
+
+        # Use the same time for every query, so the goals we reset are the ones we loaded.
         now = int(time.time())
+        start = time.time()
 
-        records = self.__db.get_all_sql('SELECT * FROM user_goals WHERE reset <= %s', [now])
-        completed = 0
-        for record in records:
+        goals = db.get_all_sql(
+            f"SELECT g.id, g.type, {Goal.RESET_TIMEZONE} AS timezone FROM user_goals g {Goal.RESET_JOIN} WHERE g.reset <= %s",
+            [now]
+        )
 
-            # Calculate the next reset time for the goal, depending on its type.
-            user = User(record['user'], 0)
+        # Group them by (timezone, type).
+        groups = {}
+        for goal in goals:
+            groups.setdefault((goal['timezone'], goal['type']), []).append(goal['id'])
+
+        # Calculate the next reset time and the date to record in the history, for each timezone and goal type.
+        # If the timezone is invalid, reset them as UTC instead, otherwise they would stay overdue forever.
+        resets = {}
+        dates = {}
+        for (timezone, type), ids in groups.items():
             try:
-                user.reset_goal(record)
-                completed += 1
+                next = helper.get_midnight_utc(timezone, type)
+                date = helper.get_previous_date(timezone, type)
             except pytz.exceptions.UnknownTimeZoneError:
-                self.__helper.error('Invalid timezone (' + user.get_setting('timezone') + ') for user ' + str(record['user']))
+                helper.error(f"Invalid timezone ({timezone}) for {len(ids)} {type} goal(s), resetting them as UTC")
+                next = helper.get_midnight_utc('UTC', type)
+                date = helper.get_previous_date('UTC', type)
 
-        self.__helper.log(f"[TASK] Ran Goal.task_reset for {completed}/{len(records)} records")
+            for id in ids:
+                resets[id] = next
+                dates[id] = date
+
+        # Add the current values to the history table and reset the goals, by id, in one transaction.
+        completed = 0
+        total = len(goals)
+        ids = list(resets.keys())
+        with db.transaction():
+            for index in range(0, len(ids), Goal.RESET_BATCH_SIZE):
+                batch = ids[index:index + Goal.RESET_BATCH_SIZE]
+
+                case, params = build_case('id', {id: dates[id] for id in batch})
+                db.execute(
+                    f"INSERT INTO user_goals_history (user, type, date, goal, result, completed) "
+                    f"SELECT user, type, {case}, goal, current, completed FROM user_goals WHERE id IN {build_in(batch)} AND reset <= %s",
+                    params + batch + [now]
+                )
+
+                case, params = build_case('id', {id: resets[id] for id in batch})
+                completed += db.execute(
+                    f"UPDATE user_goals SET completed = 0, current = 0, reset = {case} WHERE id IN {build_in(batch)} AND reset <= %s",
+                    params + batch + [now]
+                )
+
+        elapsed = time.time() - start
+        rate = int(completed / elapsed) if elapsed > 0 else completed
+        helper.log(f"[TASK] Ran Goal.task_reset for {completed}/{total} records in {len(groups)} groups ({elapsed:.2f}s, {rate} rows/s)")
+
+        # Schedule the task again for the next boundary.
+        Goal.schedule_reset()
 
         return True
 
+    @staticmethod
+    def get_next_reset():
+        """
+        Get the next time any goal is due to reset.
+        This is the next midnight (day, week, month or year) in each of the timezones which have goals of that type, or
+        the earliest reset time stored against a goal, if that is sooner (e.g. goals which are already overdue).
+        It is never sooner than RESET_MIN_DELAY seconds from now, so goals which are still overdue can't make the task spin.
+        :return: int|None None if there are no goals
+        """
+        db = Database.instance()
+        helper = Helper.instance()
+
+        times = []
+
+        buckets = db.get_all_sql(f"SELECT DISTINCT {Goal.RESET_TIMEZONE} AS timezone, g.type FROM user_goals g {Goal.RESET_JOIN}", [])
+        for bucket in buckets:
+            try:
+                times.append(helper.get_midnight_utc(bucket['timezone'], bucket['type']))
+            except pytz.exceptions.UnknownTimeZoneError:
+                pass
+
+        record = db.get_sql('SELECT MIN(reset) AS reset FROM user_goals', [])
+        if record and record['reset'] is not None:
+            times.append(int(record['reset']))
+
+        if not times:
+            return None
+
+        return max(min(times), int(time.time()) + Goal.RESET_MIN_DELAY)
+
+    @staticmethod
+    def schedule_reset(reset=None):
+        """
+        Schedule the reset task for the next time a goal is due to reset.
+        If a reset time is passed in, the task is only moved if that is sooner than it is currently scheduled for, e.g. when a new goal is set.
+        :param reset:
+        :return:
+        """
+        task = Task.get('reset', 'goal', Goal.TASK_RESET_OBJECT_ID)
+
+        if reset is None:
+            reset = Goal.get_next_reset()
+        elif task and task['time'] <= reset:
+            return
+
+        # No goals left, so there is nothing to schedule until one is set.
+        if reset is None:
+            return Task.cancel('goal', Goal.TASK_RESET_OBJECT_ID, 'reset')
+
+        return Task.schedule('reset', reset, 'goal', Goal.TASK_RESET_OBJECT_ID)
+
     @staticmethod
     def setup_tasks():
         """
         Setup the task records
         :return:
         """
-        # Delete task records and re-create, in case they got stuck somehow.
+        # Remove the old recurring reset task, if it's still there, then schedule the reset for the next boundary.
         db = Database.instance()
-        db.delete('tasks', {'object': 'goal', 'type': 'reset'})
-        db.insert('tasks', {'object': 'goal', 'time': 0, 'type': 'reset', 'recurring': 1, 'runeveryseconds': Goal.TASK_RESET_LOOP_TIME})
+        db.delete('tasks', {'object': 'goal', 'type': 'reset', 'recurring': 1})
+        Goal.schedule_reset()
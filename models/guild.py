@@ -1,7 +1,13 @@
+from models.bus import Bus
+from models.cache import Cache
 from models.database import Database
+from config import GUILD_CACHE_TTL
 
 class Guild:
 
+    # Cache of guild id => (settings, disabled commands), shared by all Guild objects.
+    CACHE = Cache('guild_settings', ttl=GUILD_CACHE_TTL)
+
     def __init__(self, guild_id):
         self.__db = Database.instance()
         self.id = str(guild_id)
@@ -46,9 +52,13 @@ class Guild:
 
     def load_settings(self):
         """
-        Load the settings for this guild from the database
+        Load the settings for this guild from the cache, or from the database if they aren't cached
         :return:
         """
+        cached = Guild.CACHE.get(self.id)
+        if cached is not None:
+            self.settings, self.disabled = cached
+            return
 
         # Get the user_settings records
         records = self.__db.get_all('guild_settings', {'guild': self.id})
@@ -60,45 +70,80 @@ class Guild:
         for row in records:
             self.settings[row['setting']] = row['value']
 
+        self.load_disabled()
+        Guild.CACHE.set(self.id, (self.settings, self.disabled))
+
+    @staticmethod
+    def load_all():
+        """
+        Load the settings for all guilds into the cache in one query, so they are there before the first commands come in
+        :return: int The number of guilds loaded
+        """
+        records = Database.instance().get_all('guild_settings', None, ['guild', 'setting', 'value'])
+
+        guilds = {}
+        for row in records:
+            guilds.setdefault(str(row['guild']), {})[row['setting']] = row['value']
+
+        for id, settings in guilds.items():
+            guild = Guild(id)
+            guild.settings = settings
+            guild.load_disabled()
+            Guild.CACHE.set(guild.id, (guild.settings, guild.disabled))
+
+        return len(guilds)
+
+    def invalidate(self):
+        """
+        Remove this guild's settings from the cache in all processes, so they are loaded again next time
+        :return:
+        """
+        Bus.instance().publish(Guild.CACHE.name, self.id)
+        self.settings = None
+        self.disabled = None
+
     def update_setting(self, setting, value):
 
         # If the user already has a value for this setting, we want to update
         user_setting = self.get_setting(setting)
 
         if user_setting:
-            return self.__db.update('guild_settings', {'value': value}, {'guild': self.id, 'setting': setting})
+            result = self.__db.update('guild_settings', {'value': value}, {'guild': self.id, 'setting': setting})
 
         # Otherwise, we want to insert a new one
         else:
-            return self.__db.insert('guild_settings', {'guild': self.id, 'setting': setting, 'value': value})
+            result = self.__db.insert('guild_settings', {'guild': self.id, 'setting': setting, 'value': value})
+
+        self.invalidate()
+        return result
 
     def load_disabled(self):
         """
         Load list of which commands this guild has disabled
         :return:
         """
-        raw = self.get_setting('disabled')
+        raw = self.settings.get('disabled') if self.settings is not None else self.get_setting('disabled')
         if raw == None:
-            self.disabled = set()
+            self.disabled = frozenset()
         else:
-            self.disabled = set(raw.split(','))
+            self.disabled = frozenset(raw.split(','))
 
     def disable_enable_command(self, command, disable: bool):
         """
         Disable or enable a command.
         """
         if self.disabled == None:
-            self.load_disabled()
+            self.load_settings()
         if disable:
-            self.disabled.add(command)
+            disabled = self.disabled | {command}
         else:
-            self.disabled.discard(command)
-        self.update_setting('disabled', ','.join(self.disabled))
+            disabled = self.disabled - {command}
+        self.update_setting('disabled', ','.join(disabled))
 
     def is_command_enabled(self, command):
         """
         Check is a command is enabled for this server.
         """
         if self.disabled == None:
-            self.load_disabled()
+            self.load_settings()
         return not (command in self.disabled)
@@ -11,6 +11,9 @@ class Helper:
     Class of generic helper functions
     """
 
+    # The maximum number of characters Discord allows in a message.
+    MESSAGE_LIMIT = 2000
+
     def log(self, text):
         """
         Write to the bot.log log file
@@ -53,6 +56,38 @@ class Helper:
         except (ValueError, TypeError):
             return False
 
+    def split_message(self, lines, limit=MESSAGE_LIMIT):
+        """
+        Join lines of text into as few messages as possible, each within Discord's length limit.
+        Lines are kept whole, unless a single line is longer than the limit on its own.
+        :param lines:
+        :param limit:
+        :return: list
+        """
+        messages = []
+        message = ''
+
+        for line in lines:
+
+            # Split up any line which is too long to fit in a message at all.
+            while len(line) > limit:
+                if message:
+                    messages.append(message)
+                    message = ''
+                messages.append(line[:limit])
+                line = line[limit:]
+
+            if message and len(message) + len(line) + 1 > limit:
+                messages.append(message)
+                message = ''
+
+            message = message + '\n' + line if message else line
+
+        if message:
+            messages.append(message)
+
+        return messages
+
     def get(self, file, as_object=True):
         """
         Load a JSON file and return the contents
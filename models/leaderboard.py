@@ -0,0 +1,216 @@
+import asyncio, bisect, time
+from models.channel import Channel
+from models.database import Database
+from models.guild import Guild
+from models.helper import Helper
+from models.sprint_registry import SprintRegistry
+from config import LEADERBOARD_INTERVAL
+
+class Leaderboard:
+    """
+    Live leaderboard for a sprint, posted in its channels and edited as word counts are submitted.
+    Word counts are kept in memory, sorted by words written, so redrawing it doesn't need a query. However many updates
+    arrive, the messages are edited at most once every LEADERBOARD_INTERVAL seconds, with the latest standings.
+    Guilds turn it on with the `sprint_leaderboard` setting. For a global sprint, it is posted in the channel of each
+    linked guild which has turned it on, with everyone's standings.
+    """
+
+    # The number of places shown, to keep the message well within the length limit.
+    SIZE = 20
+
+    # Dictionary of sprint id => Leaderboard, for the sprints running in this process.
+    BOARDS = {}
+
+    def __init__(self, sprint, bot):
+        """
+        Instantiate the object
+        :param sprint:
+        :param bot:
+        """
+        self.__db = Database.instance()
+        self.__helper = Helper.instance()
+        self.__bot = bot
+
+        self.sprint = sprint.id
+        self.guild = sprint.guild
+        self.channel = sprint.channel
+
+        # The channels to post it in.
+        self.channels = []
+
+        # Dictionary of user => words written, and a list of (-words, user) kept sorted, so the most words come first.
+        self.__words = {}
+        self.__ranking = []
+
+        # Dictionary of channel => the leaderboard message posted in it.
+        self.__messages = {}
+        self.__edited = 0
+        self.__pending = None
+
+    @staticmethod
+    def is_enabled(guild):
+        """
+        Check if a guild has turned on live leaderboards
+        :param guild:
+        :return: bool
+        """
+        return str(Guild(guild).get_setting('sprint_leaderboard')) == '1'
+
+    @staticmethod
+    def get(sprint, bot):
+        """
+        Get the leaderboard for a sprint, creating it from the sprint's current word counts if there isn't one yet
+        :param sprint:
+        :param bot:
+        :return: Leaderboard|None None if none of the guilds taking part have turned it on
+        """
+        channels = [channel for guild, channel in sprint.get_channels() if Leaderboard.is_enabled(guild)]
+        if not channels:
+            Leaderboard.discard(sprint.id)
+            return None
+
+        board = Leaderboard.BOARDS.get(sprint.id)
+        if board is None:
+            Leaderboard.prune()
+            board = Leaderboard(sprint, bot)
+            board.load(sprint.TYPE_NO_WORDCOUNT)
+            Leaderboard.BOARDS[sprint.id] = board
+
+        # Channels can be linked, or guilds can turn it on or off, while the sprint is running.
+        board.channels = channels
+        return board
+
+    @staticmethod
+    def discard(sprint_id):
+        """
+        Stop updating a sprint's leaderboard, e.g. once it has been completed or cancelled
+        :param sprint_id:
+        :return:
+        """
+        board = Leaderboard.BOARDS.pop(sprint_id, None)
+        if board is not None:
+            board.cancel()
+
+    @staticmethod
+    def prune():
+        """
+        Discard the leaderboards of any sprints which are no longer active, e.g. if they were completed by another process
+        :return:
+        """
+        registry = SprintRegistry.instance()
+        for sprint_id, board in list(Leaderboard.BOARDS.items()):
+            record = registry.get(board.guild, board.channel)
+            if record is None or record['id'] != sprint_id:
+                Leaderboard.discard(sprint_id)
+
+    def load(self, no_wordcount):
+        """
+        Load the word counts of everyone taking part in the sprint
+        :param no_wordcount: The sprint_type of users who aren't submitting word counts, who are left off
+        :return:
+        """
+        records = self.__db.get_all_sql(
+            'SELECT user, starting_wc, current_wc, ending_wc FROM sprint_users WHERE sprint = %s AND (sprint_type IS NULL OR sprint_type != %s)',
+            [self.sprint, no_wordcount]
+        )
+
+        self.__words = {}
+        for record in records:
+            wordcount = record['ending_wc'] or record['current_wc']
+            self.__words[int(record['user'])] = int(wordcount) - int(record['starting_wc'])
+
+        self.__ranking = sorted((-words, user) for user, words in self.__words.items())
+
+    def set(self, user, words):
+        """
+        Set the number of words a user has written, and schedule the message to be updated
+        :param user:
+        :param words:
+        :return:
+        """
+        self.remove(user, update=False)
+
+        self.__words[int(user)] = words
+        bisect.insort(self.__ranking, (-words, int(user)))
+        self.schedule()
+
+    def remove(self, user, update=True):
+        """
+        Remove a user from the leaderboard, e.g. if they leave the sprint
+        :param user:
+        :param update: Whether to schedule the message to be updated
+        :return:
+        """
+        words = self.__words.pop(int(user), None)
+        if words is None:
+            return
+
+        index = bisect.bisect_left(self.__ranking, (-words, int(user)))
+        del self.__ranking[index]
+
+        if update:
+            self.schedule()
+
+    def render(self):
+        """
+        Build the leaderboard message
+        :return: str
+        """
+        lines = [f"**Sprint leaderboard** (updated <t:{int(time.time())}:R>)"]
+
+        for position, (words, user) in enumerate(self.__ranking[:self.SIZE], start=1):
+            lines.append(f"`{position}.` <@{user}> - **{-words}** words")
+
+        if len(self.__ranking) > self.SIZE:
+            lines.append(f"...and {len(self.__ranking) - self.SIZE} more")
+
+        return '\n'.join(lines)
+
+    def schedule(self):
+        """
+        Schedule the message to be updated, unless an update is already waiting to go out, which will include this change
+        :return:
+        """
+        if self.__pending is None:
+            self.__pending = asyncio.get_event_loop().create_task(self.__post_later())
+
+    def cancel(self):
+        """
+        Cancel any update which is waiting to go out
+        :return:
+        """
+        if self.__pending is not None:
+            self.__pending.cancel()
+            self.__pending = None
+
+    async def __post_later(self):
+        """
+        Wait until it has been long enough since the last edit, then post the latest standings
+        :return:
+        """
+        delay = self.__edited + LEADERBOARD_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Any changes from here on need another update, so clear this one before we post.
+        self.__pending = None
+        await self.post()
+
+    async def post(self):
+        """
+        Post the leaderboard message in each of its channels, or edit it where it has already been posted
+        :return:
+        """
+        content = self.render()
+        self.__edited = time.monotonic()
+
+        for channel_id in self.channels:
+            try:
+                message = self.__messages.get(channel_id)
+                if message is None:
+                    channel = await Channel.get(self.__bot, channel_id)
+                    self.__messages[channel_id] = await channel.send(content, allowed_mentions={'parse': []})
+                else:
+                    await message.edit(content=content)
+            except Exception as e:
+                self.__helper.error(f"[SPRINT] Failed to post leaderboard for sprint {self.sprint} in channel {channel_id}: {e}")
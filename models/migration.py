@@ -0,0 +1,253 @@
+import json, os, pymysql, time
+from models.database import Database
+from models.helper import Helper
+from config import APP_DIR
+
+class Migration:
+    """
+    Runs the versioned database updates in data/updates/.
+    Each update file is named after the version it brings the database up to (e.g. 2026101800.json) and contains an
+    array of steps. Progress is recorded in the schema_version table after every step (and every batch of a column
+    conversion), so an update which is interrupted carries on from where it left off the next time the bot boots.
+    """
+
+    # How many rows to backfill in each batch when converting columns.
+    BATCH_SIZE = 5000
+
+    # How many seconds to pause between batches, so we don't saturate the database while the bot is running.
+    BATCH_PAUSE = 0.05
+
+    # MySQL error codes which mean a DDL statement has already been applied, so it is safe to carry on after them.
+    # 1050: Table exists, 1060: Duplicate column, 1061: Duplicate key, 1091: Can't drop (doesn't exist), 1359: Trigger exists.
+    ALREADY_APPLIED = [1050, 1060, 1061, 1091, 1359]
+
+    # Column types which need their old TEXT values casting to numbers when converted.
+    NUMERIC_TYPES = ['INT', 'INTEGER', 'BIGINT', 'SMALLINT', 'TINYINT']
+
+    # Suffixes given to the shadow copy of a table built while converting its columns, and to the original table once
+    # the shadow has been swapped in.
+    SHADOW_SUFFIX = '__new'
+    OLD_SUFFIX = '__old'
+
+    # MySQL error code for a duplicate entry, and how many times to clean up duplicates and retry adding a unique index.
+    DUPLICATE_ENTRY = 1062
+    UNIQUE_ATTEMPTS = 5
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__db = Database.instance()
+        self.__helper = Helper.instance()
+        self.__path = APP_DIR + '/data/updates/'
+
+    def get_version(self):
+        """
+        Get the most recent version which has been fully applied to the database
+        :return: int
+        """
+        record = self.__db.get_sql('SELECT MAX(version) AS version FROM schema_version WHERE completed > 0', [])
+        return int(record['version']) if record and record['version'] is not None else 0
+
+    def get_updates(self):
+        """
+        Get a sorted list of all the update versions available in the data/updates/ directory
+        :return: list
+        """
+        versions = []
+        for filename in os.listdir(self.__path):
+            name, extension = os.path.splitext(filename)
+            if extension == '.json' and name.isdigit():
+                versions.append(int(name))
+        return sorted(versions)
+
+    def get_pending(self):
+        """
+        Get the update versions which have not been fully applied yet
+        :return: list
+        """
+        current = self.get_version()
+        return [version for version in self.get_updates() if version > current]
+
+    def run(self):
+        """
+        Apply all of the pending updates, in version order
+        :return: int The number of updates applied
+        """
+        pending = self.get_pending()
+        for version in pending:
+            self.apply(version)
+
+        return len(pending)
+
+    def apply(self, version):
+        """
+        Apply a single update, resuming from the last recorded step if it was interrupted
+        :param version:
+        :return:
+        """
+        with open(self.__path + str(version) + '.json', 'r') as file:
+            steps = json.load(file)
+
+        progress = self.__db.get('schema_version', {'version': version})
+        if progress is None:
+            self.__db.insert('schema_version', {'version': version})
+            progress = self.__db.get('schema_version', {'version': version})
+
+        if progress['step'] > 0:
+            self.__helper.log(f"[DB] Resuming update {version} from step {progress['step'] + 1}/{len(steps)}")
+        else:
+            self.__helper.log(f"[DB] Applying update {version} ({len(steps)} steps)")
+
+        for index in range(progress['step'], len(steps)):
+            self.run_step(version, steps[index], progress['position'] if index == progress['step'] else 0)
+            self.__db.update('schema_version', {'step': index + 1, 'position': 0}, {'version': version})
+
+        self.__db.update('schema_version', {'completed': int(time.time())}, {'version': version})
+        self.__helper.log(f"[DB] Update {version} applied")
+
+    def run_step(self, version, step, position):
+        """
+        Run one step of an update. A step is either a string of SQL, or a dictionary describing a column conversion or
+        a unique index.
+        :param version:
+        :param step:
+        :param position: The id the step had reached last time, if it was interrupted part way through
+        :return:
+        """
+        if isinstance(step, str):
+            return self.execute(step)
+        elif 'convert' in step:
+            return self.convert(version, step['convert'], step['columns'], position)
+        elif 'unique' in step:
+            return self.unique(step['unique'], step['index'], step['columns'])
+        else:
+            raise ValueError(f"Invalid step in update {version}: {step}")
+
+    def execute(self, sql, params=[]):
+        """
+        Execute some SQL, ignoring errors which just mean it has already been applied
+        :param sql:
+        :param params:
+        :return:
+        """
+        try:
+            return self.__db.execute(sql, params)
+        except (pymysql.err.InternalError, pymysql.err.OperationalError, pymysql.err.ProgrammingError) as e:
+            if e.args[0] in self.ALREADY_APPLIED:
+                return 0
+            raise
+
+    def table_exists(self, table):
+        """
+        Check if a table exists
+        :param table:
+        :return: bool
+        """
+        record = self.__db.get_sql(
+            'SELECT COUNT(*) AS cnt FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [table]
+        )
+        return record['cnt'] > 0
+
+    def get_columns(self, table):
+        """
+        Get the names of a table's columns, in order
+        :param table:
+        :return: list
+        """
+        records = self.__db.get_all_sql(
+            'SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION',
+            [table]
+        )
+        return [record['name'] for record in records]
+
+    def convert(self, version, table, columns, position):
+        """
+        Convert the types of some columns on a table without holding a long lock on it.
+        A shadow copy of the table is created with the new column types. Triggers copy every write on the table across to
+        it, while the existing rows are copied over in batches of ids. The shadow is then swapped in with an atomic
+        RENAME TABLE, so the table is never locked for longer than the rename takes.
+        :param version:
+        :param table:
+        :param columns: Dictionary of column name => new column definition, e.g. {'user': 'BIGINT UNSIGNED NOT NULL'}
+        :param position: The last id which was copied, if we are resuming
+        :return:
+        """
+        shadow = table + self.SHADOW_SUFFIX
+        old = table + self.OLD_SUFFIX
+
+        # If the shadow table doesn't exist, either we haven't started, or we've already swapped it in.
+        if not self.table_exists(shadow):
+            if position > 0 or self.table_exists(old):
+                self.execute(f"DROP TABLE IF EXISTS {old}")
+                return
+            self.execute(f"CREATE TABLE {shadow} LIKE {table}")
+
+        # Change the column types while the shadow is still empty, which is instant. If we are resuming after rows have
+        # been copied, this has already been done.
+        if position == 0:
+            modifications = ', '.join(f"MODIFY COLUMN {column} {definition}" for column, definition in columns.items())
+            self.execute(f"ALTER TABLE {shadow} {modifications}")
+
+        # Copy any rows which are written while we copy the existing ones across to the shadow.
+        names = self.get_columns(table)
+        fields = ', '.join(names)
+        values = ', '.join(self.get_cast(name, columns[name], 'NEW.') if name in columns else 'NEW.' + name for name in names)
+        self.execute(f"CREATE TRIGGER {table}__convert_insert AFTER INSERT ON {table} FOR EACH ROW REPLACE INTO {shadow} ({fields}) VALUES ({values})")
+        self.execute(f"CREATE TRIGGER {table}__convert_update AFTER UPDATE ON {table} FOR EACH ROW REPLACE INTO {shadow} ({fields}) VALUES ({values})")
+        self.execute(f"CREATE TRIGGER {table}__convert_delete AFTER DELETE ON {table} FOR EACH ROW DELETE FROM {shadow} WHERE id = OLD.id")
+
+        # Copy the existing rows in batches, recording how far we got after each one.
+        # Rows which the triggers have already copied are newer, so they are kept rather than overwritten.
+        record = self.__db.get_sql(f"SELECT MAX(id) AS max FROM {table}", [])
+        last_id = int(record['max'] or 0)
+        casts = ', '.join(self.get_cast(name, columns[name]) if name in columns else name for name in names)
+
+        while position < last_id:
+            end = position + self.BATCH_SIZE
+            self.__db.execute(f"INSERT IGNORE INTO {shadow} ({fields}) SELECT {casts} FROM {table} WHERE id > %s AND id <= %s", [position, end])
+            position = end
+            self.__db.update('schema_version', {'position': position}, {'version': version})
+            time.sleep(self.BATCH_PAUSE)
+
+        self.__helper.log(f"[DB] Copied {last_id} rows of {table}")
+
+        # Swap the shadow in with one atomic rename, then drop the old table, which takes its triggers with it.
+        self.execute(f"RENAME TABLE {table} TO {old}, {shadow} TO {table}")
+        self.execute(f"DROP TABLE IF EXISTS {old}")
+
+    def unique(self, table, index, columns):
+        """
+        Replace an index with a unique one, deleting any duplicate rows first and keeping the newest of each.
+        The bot can still be writing to the table, so if a new duplicate appears before the index is added, the
+        duplicates are cleaned up again and it is retried.
+        :param table:
+        :param index:
+        :param columns: List of the columns in the index
+        :return:
+        """
+        matches = ' AND '.join(f"a.{column} = b.{column}" for column in columns)
+
+        for attempt in range(1, self.UNIQUE_ATTEMPTS + 1):
+            self.__db.execute(f"DELETE a FROM {table} a JOIN {table} b ON {matches} AND a.id < b.id", [])
+            try:
+                return self.execute(f"ALTER TABLE {table} DROP INDEX {index}, ADD UNIQUE INDEX {index} ({', '.join(columns)})")
+            except pymysql.err.IntegrityError as e:
+                if e.args[0] != self.DUPLICATE_ENTRY or attempt == self.UNIQUE_ATTEMPTS:
+                    raise
+                self.__helper.log(f"[DB] New duplicates in {table} while adding unique index {index}, cleaning up again (attempt {attempt})")
+
+    def get_cast(self, column, definition, prefix=''):
+        """
+        Get the SQL expression which converts the old value of a column into its new type.
+        Numeric values which aren't valid numbers are converted to 0, rather than erroring under strict mode.
+        :param column:
+        :param definition:
+        :param prefix: e.g. 'NEW.' when used in a trigger
+        :return: str
+        """
+        column = prefix + column
+        if definition.upper().split(' ')[0] in self.NUMERIC_TYPES:
+            return f"IF({column} REGEXP '^[0-9]+$', CAST({column} AS UNSIGNED), IF({column} IS NULL, NULL, 0))"
+        return column
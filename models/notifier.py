@@ -0,0 +1,92 @@
+import asyncio, time
+from models.helper import Helper
+from models.singleton import Singleton
+
+@Singleton
+class Notifier:
+    """
+    Fans out notifications which mention lots of users, e.g. everyone taking part in a sprint.
+    The mentions are packed into as few messages as possible, each within Discord's length limit and its limit on how
+    many users a message can ping, and every message says exactly which users it is allowed to mention.
+    Sending is paced per channel, so a big fan-out doesn't run into Discord's rate limits.
+    """
+
+    # Discord only pings the first 100 users listed in a message's allowed mentions.
+    MAX_MENTIONS = 100
+
+    # Discord allows 5 messages every 5 seconds in a channel, so we can send a burst of 5, then 1 a second after that.
+    BURST = 5
+    RATE = 1.0
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__helper = Helper.instance()
+
+        # Dictionary of channel => (tokens, last updated), for pacing the messages sent to each channel.
+        self.__buckets = {}
+
+    def build(self, *segments, limit=None):
+        """
+        Build the messages for a notification
+        :param segments: Each segment is either a string of text, or a list of user ids to mention, separated by commas
+        :param limit: Maximum length of each message, if not Discord's
+        :return: list of (content, allowed_mentions) tuples
+        """
+        limit = limit or self.__helper.MESSAGE_LIMIT
+        messages = []
+        content = ''
+        users = []
+
+        for segment in segments:
+
+            if isinstance(segment, str):
+                pieces = [(text, None) for text in self.__helper.split_message([segment], limit)]
+            else:
+                pieces = [((', ' if index else '') + f"<@{user}>", str(user)) for index, user in enumerate(segment)]
+
+            for text, user in pieces:
+
+                # Start a new message if this one is full. Whatever carries on starts without its leading comma or line break.
+                if content and (len(content) + len(text) > limit or (user is not None and len(users) >= self.MAX_MENTIONS)):
+                    messages.append((content, {'parse': [], 'users': users}))
+                    content = ''
+                    users = []
+                    text = text.lstrip(', \n')
+
+                content += text
+                if user is not None:
+                    users.append(user)
+
+        if content:
+            messages.append((content, {'parse': [], 'users': users}))
+
+        return messages
+
+    async def wait(self, channel):
+        """
+        Wait until we can send another message to a channel, without going over its rate limit
+        :param channel:
+        :return:
+        """
+        now = time.monotonic()
+        tokens, updated = self.__buckets.get(channel, (self.BURST, now))
+        tokens = min(self.BURST, tokens + (now - updated) * self.RATE) - 1
+
+        # Take the slot before sleeping, so that other notifications to the same channel queue up behind this one.
+        self.__buckets[channel] = (tokens, now)
+        if tokens < 0:
+            await asyncio.sleep(-tokens / self.RATE)
+
+    async def send(self, channel, messages, say):
+        """
+        Send the messages for a notification to a channel, paced to stay within its rate limit
+        :param channel: ID of the channel
+        :param messages: The messages, as returned by build()
+        :param say: async function(content, allowed_mentions) which sends a message
+        :return:
+        """
+        for content, allowed_mentions in messages:
+            await self.wait(channel)
+            await say(content, allowed_mentions)
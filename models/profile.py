@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    Read-only snapshot of a user's stats, records, XP and settings, as loaded by User.load_profile().
+    It can't be changed once created, so it is safe to pass around and share between commands.
+    """
+
+    user: str
+    stats: MappingProxyType
+    records: MappingProxyType
+    settings: MappingProxyType
+    xp: int = None
+    lvl: int = None
+    next: int = None
+
+    def get_stat(self, name):
+        """
+        Get a specific statistic
+        :param name:
+        :return: int
+        """
+        return self.stats.get(name, 0)
+
+    def get_record(self, name):
+        """
+        Get a specific record
+        :param name:
+        :return:
+        """
+        return self.records.get(name)
+
+    def get_setting(self, setting):
+        """
+        Get a specific setting
+        :param setting:
+        :return:
+        """
+        return self.settings.get(setting)
+
+    def get_xp_bar(self):
+        """
+        Get the XP bar, in the same format as User.get_xp_bar()
+        :return: str
+        """
+        if self.xp is None:
+            return '-'
+
+        goal = self.xp + self.next
+        return f"**Level {self.lvl}** ({self.xp}/{goal})"
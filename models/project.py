@@ -1,5 +1,6 @@
 import interactions
-from models.database import Database
+from models.async_database import AsyncDatabase
+from models.database import Database, build_case, build_in
 
 class Project:
 
@@ -127,6 +128,21 @@ class Project:
         """
         return self.__db.delete('projects', {'id': self.id})
 
+    @staticmethod
+    async def bulk_add_words(words, db=None):
+        """
+        Add words to multiple projects at once
+        :param words: Dictionary of project id => words to add
+        :param db: The AsyncDatabase, or a transaction started on it, to run the query on
+        :return:
+        """
+        if not words:
+            return 0
+
+        case, params = build_case('id', words)
+        return await (db or AsyncDatabase.instance()).execute(f"UPDATE projects SET words = words + {case} WHERE id IN {build_in(words)}",
+                                                              params + list(words.keys()))
+
     @staticmethod
     def validate(user, shortname, title):
         """
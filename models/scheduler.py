@@ -0,0 +1,190 @@
+import asyncio, heapq, time
+from models.async_database import AsyncDatabase
+from models.bus import Bus
+from models.helper import Helper
+from models.singleton import Singleton
+
+@Singleton
+class Scheduler:
+    """
+    In-memory min-heap of the pending tasks, keyed by the time they are due.
+    The tasks table is the durable log. It is read into the heap on startup, and Task.schedule/Task.cancel keep the heap
+    in step with it afterwards, so the loop can sleep until exactly when the next task is due instead of polling.
+    Tasks scheduled or cancelled by other processes are sent over the Bus, so the table is never re-read while running.
+    Due tasks are run in the background, so a slow batch doesn't hold up the tasks which fall due after it.
+    """
+
+    # Name the scheduled and cancelled tasks are published under.
+    NAME = 'tasks'
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__db = AsyncDatabase.instance()
+        self.__helper = Helper.instance()
+
+        # Heap of (time, id) tuples. Entries are not removed when a task is cancelled or rescheduled, instead they are
+        # skipped when they reach the top, if they no longer match the time in __due.
+        self.__heap = []
+        self.__due = {}
+        self.__wake = None
+
+        # The batches of tasks which are currently running, so they aren't garbage collected part way through.
+        self.__running = set()
+
+        Bus.instance().subscribe(self.NAME, self.receive)
+
+    async def load(self):
+        """
+        Load all the pending tasks from the database into the heap
+        :return: int The number of tasks loaded
+        """
+        self.__heap = []
+        self.__due = {}
+
+        records = await self.__db.get_all('tasks', None, ['id', 'time', 'processing', 'lease_expires'])
+        for record in records:
+            # If another process has claimed it, we don't need to look at it again until its lease expires.
+            due = record['time']
+            if record['processing'] == 1:
+                due = max(due, record['lease_expires'] + 1)
+            self.push(record['id'], due)
+
+        return len(records)
+
+    def push(self, id, time):
+        """
+        Add a task to the heap, or move it if it is already in there
+        :param id:
+        :param time:
+        :return:
+        """
+        self.__due[id] = int(time)
+        heapq.heappush(self.__heap, (int(time), id))
+
+        # Wake the loop up, in case this task is due before the one it is currently sleeping until.
+        self.wake()
+
+    def discard(self, id):
+        """
+        Remove a task from the heap
+        :param id:
+        :return:
+        """
+        self.__due.pop(id, None)
+
+    def schedule(self, id, time):
+        """
+        Add a task to the heap, or move it, here and in all the other processes
+        :param id:
+        :param time:
+        :return:
+        """
+        self.push(id, time)
+        Bus.instance().publish(self.NAME, [id, int(time)], local=False)
+
+    def cancel(self, id):
+        """
+        Remove a task from the heap, here and in all the other processes
+        :param id:
+        :return:
+        """
+        self.discard(id)
+        Bus.instance().publish(self.NAME, [id, None], local=False)
+
+    def receive(self, key):
+        """
+        Handle a task being scheduled or cancelled by another process
+        :param key: tuple of (id, time), where the time is None if it was cancelled
+        :return:
+        """
+        id, time = key
+        if time is None:
+            self.discard(id)
+        else:
+            self.push(id, time)
+
+    def wake(self):
+        """
+        Wake the loop up so it re-checks when the next task is due
+        :return:
+        """
+        if self.__wake is not None:
+            self.__wake.set()
+
+    def next_time(self):
+        """
+        Get the time the next task is due, discarding any cancelled or rescheduled entries at the top of the heap
+        :return: int|None
+        """
+        while self.__heap:
+            time, id = self.__heap[0]
+            if self.__due.get(id) == time:
+                return time
+            heapq.heappop(self.__heap)
+
+        return None
+
+    def pop_due(self, now):
+        """
+        Remove and return the ids of all the tasks which are due, in the order they are due
+        :param now:
+        :return: list
+        """
+        ids = []
+        while True:
+            next = self.next_time()
+            if next is None or next > now:
+                break
+            time, id = heapq.heappop(self.__heap)
+            del self.__due[id]
+            ids.append(id)
+
+        return ids
+
+    async def run(self, bot, callback):
+        """
+        The scheduler loop. Sleep until the next task is due (or until woken up by a new task), then pass the due task ids to the callback.
+        Each batch runs in its own asyncio task, so the loop goes straight back to waiting for the next one.
+        :param bot:
+        :param callback: async function(bot, ids)
+        :return:
+        """
+        self.__wake = asyncio.Event()
+
+        # Don't try and run anything until the bot is connected, as most tasks want to post messages.
+        await bot.wait_until_ready()
+        pending = await self.load()
+        self.__helper.log(f"[TASK] Scheduler started with {pending} pending task(s)")
+
+        while True:
+
+            next = self.next_time()
+            delay = None if next is None else next - time.time()
+
+            if delay is None or delay > 0:
+                self.__wake.clear()
+                try:
+                    await asyncio.wait_for(self.__wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            ids = self.pop_due(time.time())
+            batch = asyncio.get_event_loop().create_task(self.dispatch(bot, callback, ids))
+            self.__running.add(batch)
+            batch.add_done_callback(self.__running.discard)
+
+    async def dispatch(self, bot, callback, ids):
+        """
+        Run a batch of due tasks, logging any error rather than letting it go unnoticed in the background
+        :param bot:
+        :param callback:
+        :param ids:
+        :return:
+        """
+        try:
+            await callback(bot, ids)
+        except Exception as e:
+            self.__helper.error(f"[TASK] Error running tasks {ids}: {e}")
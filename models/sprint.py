@@ -1,11 +1,16 @@
-import interactions, math, numpy, time
+import math, numpy, pymysql, secrets, time
 from operator import itemgetter
-from models.database import Database
+from models.async_database import AsyncDatabase
+from models.channel import Channel
+from models.database import Database, build_in
 from models.experience import Experience
 from models.guild import Guild
 from models.helper import Helper
+from models.leaderboard import Leaderboard
+from models.notifier import Notifier
 from models.project import Project
-from models.task import Task
+from models.sprint_registry import SprintRegistry
+from models.task import Task, task_handler
 from models.user import User
 
 class Sprint:
@@ -14,20 +19,35 @@ class Sprint:
     DEFAULT_POST_DELAY = 2
     WINNING_POSITION = 1
 
-    def __init__(self, guild_id: int, bot = None):
+    # Discord returns at most 1000 members per request when listing a guild's members.
+    MEMBER_PAGE_SIZE = 1000
+
+    # Log the progress of a purge every this many pages of members.
+    PURGE_PROGRESS_PAGES = 50
+
+    # How many user_settings rows to delete per query when purging.
+    PURGE_CHUNK_SIZE = 1000
+
+    def __init__(self, guild_id: int, channel_id: int = None, bot = None, record = None):
         """
         Instantiate the object
+        :param guild_id:
+        :param channel_id: The channel or thread the sprint is running in. Each one can have its own sprint.
+        :param bot:
+        :param record: The sprints record, if it has already been loaded, to save loading it again
         """
         self.__db = Database.instance()
         self.__helper = Helper.instance()
         self.__bot = bot
 
-        # TODO: Threads
-
         self.id = None
         self.guild = str(guild_id)
+        self.channel = str(channel_id)
 
-        self.load()
+        if record is not None:
+            self.set_record(record)
+        else:
+            self.load()
 
     def is_valid(self):
         """
@@ -85,17 +105,24 @@ class Sprint:
         now = int(time.time())
         return self.start <= now
 
-    def load(self, by: str = 'guild'):
+    def load(self, by: str = 'channel'):
         """
-        Try to load the sprint out of the database for the given guild_id
+        Try to load the sprint for the given guild and channel from the registry of active sprints, or out of the database by its id
         :return: bool
         """
         if by == 'id':
-            params = {'id': self.id, 'completed': 0}
+            result = self.__db.get('sprints', {'id': self.id, 'completed': 0})
         else:
-            params = {'guild': self.guild, 'completed': 0}
+            result = SprintRegistry.instance().get(self.guild, self.channel)
+
+        return self.set_record(result)
 
-        result = self.__db.get('sprints', params)
+    def set_record(self, result):
+        """
+        Set the properties of the sprint from a sprints record
+        :param result:
+        :return: bool
+        """
         if result:
             self.id = result['id']
             self.guild = result['guild']
@@ -107,6 +134,7 @@ class Sprint:
             self.createdby = result['createdby']
             self.created = result['created']
             self.completed = result['completed']
+            self.code = result.get('code')
             return True
         else:
             self.id = None
@@ -119,6 +147,7 @@ class Sprint:
             self.createdby = None
             self.created = None
             self.completed = None
+            self.code = None
             return False
 
     def reload(self):
@@ -128,12 +157,13 @@ class Sprint:
         """
         return self.load()
 
-    def join(self, user_id, start: int = 0, type: str = None, project_id: int = None):
+    def join(self, user_id, start: int = 0, type: str = None, project_id: int = None, guild_id: int = None):
         """
         Add a user to a sprint with an optional starting word count number
         :param user_id:
         :param starting_wc:
         :param sprint_type:
+        :param guild_id: The guild they are joining from, if it's a global sprint linked to other guilds
         :return: void
         """
         # Get the current timestamp
@@ -148,6 +178,7 @@ class Sprint:
                          {
                              'sprint': self.id,
                              'user': user_id,
+                             'guild': guild_id if guild_id is not None else self.guild,
                              'starting_wc': start,
                              'current_wc': start,
                              'ending_wc': 0,
@@ -157,6 +188,10 @@ class Sprint:
                          }
          )
 
+        registry = SprintRegistry.instance()
+        registry.add_user(self.id, user_id)
+        registry.publish(self.guild, self.channel)
+
     def get_users(self):
         """
         Get an array of all the sprint_users records for users taking part in this sprint
@@ -166,29 +201,96 @@ class Sprint:
         users = self.__db.get_all('sprint_users', {'sprint': self.id})
         return [int(row['user']) for row in users]
 
-    def get_notify_users(self):
+    def get_users_by_guild(self):
+        """
+        Get the users taking part in this sprint, grouped by the guild they joined from
+        :return: Dictionary of guild => list of user ids
+        """
+        users = self.__db.get_all_sql('SELECT user, COALESCE(guild, %s) AS guild FROM sprint_users WHERE sprint = %s',
+                                      [self.guild, self.id])
+
+        guilds = {}
+        for row in users:
+            guilds.setdefault(str(row['guild']), []).append(int(row['user']))
+        return guilds
+
+    def get_channels(self):
+        """
+        Get the channels taking part in this sprint. For a global sprint, this includes the channels linked to it from other guilds.
+        :return: list of (guild, channel), starting with the channel it was started in
+        """
+        channels = SprintRegistry.instance().get_channels(self.id)
+        if not channels:
+            links = self.__db.get_all('sprint_channels', {'sprint': self.id}, ['guild', 'channel'], ['id'])
+            channels = [(str(self.guild), str(self.channel))] + [(str(row['guild']), str(row['channel'])) for row in links]
+        return channels
+
+    def share(self):
+        """
+        Let other guilds link their channels to this sprint, by giving it a code they can link with
+        :return: str The code
+        """
+        if not self.code:
+            self.code = secrets.token_hex(4)
+            self.update({'code': self.code})
+
+        return self.code
+
+    def link(self, guild_id, channel_id, user_id):
+        """
+        Link a channel in another guild to this sprint, so its members can take part too
+        :param guild_id:
+        :param channel_id:
+        :param user_id: The user linking it
+        :return: bool False if the guild is already linked to it
+        """
+        try:
+            self.__db.insert('sprint_channels', {'sprint': self.id, 'guild': guild_id, 'channel': channel_id,
+                                                 'linkedby': user_id, 'linked': int(time.time())})
+        except pymysql.err.IntegrityError:
+            return False
+
+        registry = SprintRegistry.instance()
+        registry.link(self.id, guild_id, channel_id)
+        registry.publish(self.guild, self.channel)
+        return True
+
+    def unlink(self, guild_id = None):
+        """
+        Remove a linked guild's channel from this sprint, along with the users who joined from it
+        :param guild_id: The guild to remove, or None to remove all of them and stop sharing the sprint
+        :return: int The number of users removed
+        """
+        if guild_id is None:
+            self.code = None
+            self.__db.update('sprints', {'code': None}, {'id': self.id})
+            self.__db.delete('sprint_channels', {'sprint': self.id})
+            removed = self.__db.execute('DELETE FROM sprint_users WHERE sprint = %s AND guild IS NOT NULL AND guild != %s', [self.id, self.guild])
+        else:
+            self.__db.delete('sprint_channels', {'sprint': self.id, 'guild': guild_id})
+            removed = self.__db.delete('sprint_users', {'sprint': self.id, 'guild': guild_id})
+
+        # Reload it from the database, rather than working out which users and channels to remove from the registry.
+        registry = SprintRegistry.instance()
+        registry.reload(SprintRegistry.key(self.guild, self.channel))
+        registry.publish(self.guild, self.channel)
+        Leaderboard.discard(self.id)
+        return removed
+
+    def get_notify_users(self, guild_id = None):
         """
         Get an array of all the users who want to be notified about new sprints on this server
+        :param guild_id: The guild to get them for, if not the one the sprint was started in
         :return:
         """
-        notify = self.__db.get_all('user_settings', {'guild': self.guild, 'setting': 'sprint_notify', 'value': 1})
+        guild_id = guild_id if guild_id is not None else self.guild
+        notify = self.__db.get_all('user_settings', {'guild': guild_id, 'setting': 'sprint_notify', 'value': 1})
         notify_ids = [int(row['user']) for row in notify]
 
         # We don't need to notify users who are already in the sprint, so we can exclude those
         users_ids = self.get_users()
         return numpy.setdiff1d(notify_ids, users_ids).tolist()
 
-    def get_notifications(self, users):
-        """
-        Get an array of user mentions for each person in the supplied array of userids
-        :return:
-        """
-        notify = []
-        for user_id in users:
-            usr = User(user_id, self.guild)
-            notify.append(usr.get_mention())
-        return notify
-
     def cancel(self, context):
         """
         Cancel the sprint and notify the users who were taking part
@@ -197,15 +299,21 @@ class Sprint:
         # Load current user
         user = User(context.author.id, context.guild_id, context)
 
-        # Delete sprints and sprint_users records
+        # Delete sprints, sprint_users and sprint_channels records
         self.__db.delete('sprint_users', {'sprint': self.id})
+        self.__db.delete('sprint_channels', {'sprint': self.id})
         self.__db.delete('sprints', {'id': self.id})
 
         # Delete pending scheduled tasks
         Task.cancel('sprint', self.id)
+        Leaderboard.discard(self.id)
+
+        registry = SprintRegistry.instance()
+        registry.remove(self.guild, self.channel)
+        registry.publish(self.guild, self.channel)
 
         # If the user created this, decrement their created stat
-        if user.id == self.createdby:
+        if int(user.id) == int(self.createdby):
             user.add_stat('sprints_started', -1)
 
     def update(self, params):
@@ -216,6 +324,10 @@ class Sprint:
         """
         self.__db.update('sprints', params, {'id': self.id})
 
+        registry = SprintRegistry.instance()
+        registry.update(self.guild, self.channel, params)
+        registry.publish(self.guild, self.channel)
+
     def leave(self, user_id):
         """
         Remove a user from the sprint
@@ -224,14 +336,22 @@ class Sprint:
         """
         self.__db.delete('sprint_users', {'sprint': self.id, 'user': user_id})
 
+        registry = SprintRegistry.instance()
+        registry.remove_user(self.id, user_id)
+        registry.publish(self.guild, self.channel)
+
+        # Take them off the live leaderboard, if there is one.
+        board = Leaderboard.BOARDS.get(self.id)
+        if board is not None:
+            board.remove(user_id)
+
     def is_user_sprinting(self, user_id):
         """
         Check if a given user is in the sprint
         :param int user_id:
         :return:
         """
-        user_ids = self.get_users()
-        return int(user_id) in user_ids
+        return SprintRegistry.instance().has_user(self.id, user_id)
 
     def get_user_sprint(self, user_id):
         """
@@ -292,22 +412,23 @@ class Sprint:
         :param bot:
         :return:
         """
-        # Build the message to display
-        message = f"**Sprint has started**\nGet writing, you have {self.length} minute(s).\n"
+        users = self.get_users_by_guild()
+
+        def build(guild):
+
+            # Build the message to display, with a mention for anyone from this guild who has joined the sprint.
+            message = [f"**Sprint has started**\nGet writing, you have {self.length} minute(s).\n:wave: ", users.get(guild, [])]
 
-        # Add mention for anyone who has joined the sprint.
-        notify_joined = ', '.join(self.get_notifications(self.get_users()))
-        message += f":wave: {notify_joined}"
+            # Add mention for any user who wants to be notified of starting sprints.
+            # If we had a delayed start, these notifications would have been done there. So only show them here, if it's an immediate start.
+            if immediate:
+                notify_users = self.get_notify_users(guild)
+                if notify_users:
+                    message += ["\n:bell: ", notify_users]
 
-        # Add mention for any user who wants to be notified of starting sprints.
-        # If we had a delayed start, these notifications would have been done there. So only show them here, if it's an immediate start.
-        if immediate:
-            notify_users = self.get_notifications(self.get_notify_users())
-            if notify_users:
-                notify_asked = ', '.join(notify_users)
-                message += f"\n:bell: {notify_asked}"
+            return message
 
-        return await self.say(message, context, bot)
+        return await self.broadcast(build, context, bot)
 
     async def post_delayed_start(self, context):
         """
@@ -321,15 +442,14 @@ class Sprint:
         delay = self.__helper.secs_to_mins((self.start + 5) - now)
 
         # Build the message to display
-        message = f"**A new sprint has been scheduled**\nSprint will start in approx {delay['m']} minutes and will run for {self.length} minute(s). Use `/sprint join` to join this sprint."
+        message = [f"**A new sprint has been scheduled**\nSprint will start in approx {delay['m']} minutes and will run for {self.length} minute(s). Use `/sprint join` to join this sprint."]
 
         # Add mentions for any user who wants to be notified
-        notify_users = self.get_notifications(self.get_notify_users())
+        notify_users = self.get_notify_users()
         if notify_users:
-            notify_asked = ', '.join(notify_users)
-            message += f"\n:bell: {notify_asked}"
+            message += ["\n:bell: ", notify_users]
 
-        return await context.send(message)
+        return await self.notify(message, context)
 
     async def end_sprint(self, context=None, bot=None):
         """
@@ -345,9 +465,6 @@ class Sprint:
         if bot is None:
             bot = self.__bot
 
-        # Get the sprinting users to notify.
-        notify = self.get_notifications(self.get_users())
-
         guild = Guild(self.guild)
         delay = guild.get_setting('sprint_delay_end')
         if delay is None:
@@ -355,8 +472,8 @@ class Sprint:
 
         # Post the ending message, asking for word counts.
         message = f"**Time is up**\nPens down. Use `/sprint wc <amount>` to submit your final word counts, you have {delay} minute(s).\n"
-        message = message + ', '.join(notify)
-        await self.say(message, context, bot)
+        users = self.get_users_by_guild()
+        await self.broadcast(lambda guild: [message, users.get(guild, [])], context, bot)
 
         # If there are only non-wc sprinters and not-one who needs to submit a word count, just complete immediately.
         if self.is_declaration_finished():
@@ -372,6 +489,10 @@ class Sprint:
     async def complete_sprint(self, context = None, bot = None):
         """
         Complete the sprint. Work out the XP, leaderboard, do the goal updating, etc...
+        Everyone's results are worked out from one sprint_users query, and their records, goals, stats, XP and projects
+        are then updated with a few bulk queries in a single transaction, however many people took part.
+        For a global sprint, everyone from every linked guild is ranked together, and the results are posted to every
+        linked channel.
         :param context:
         :param bot:
         :return:
@@ -380,35 +501,39 @@ class Sprint:
         if self.completed != 0:
             return
 
-        # Print the "Results coming shortly" message.
-        await self.say(f"The word counts are in. Results coming up shortly...", context, bot)
+        # Get the channels to post to now, as completing the sprint removes it from the registry.
+        channels = self.get_channels()
 
         # Create array to use for storing the results.
         results = []
 
-        # Mark the sprint as completed in the DB.
-        now = int(time.time())
-        self.update({'completed': now})
+        # Get all the users taking part, with their full sprint info.
+        db = AsyncDatabase.instance()
+        user_sprints = await db.get_all('sprint_users', {'sprint': self.id}, ['*'], ['id'])
 
-        # Get all the users taking part.
-        users = self.get_users()
+        # Dictionary of user => the guild they joined from.
+        guilds = {}
 
-        # Loop through them and get their full sprint info.
-        for user_id in users:
+        # Changes to make for each user, which are all written at the end.
+        stats = {}
+        wpms = {}
+        words = {}
+        projects = {}
 
-            user = User(user_id, self.guild, context=context, bot=bot, channel=self.channel)
-            user_sprint = self.get_user_sprint(user_id)
+        for user_sprint in user_sprints:
+
+            user_id = int(user_sprint['user'])
+            guilds[user_id] = str(user_sprint.get('guild') or self.guild)
 
             # If it's a non-word count sprint, we don't need to do anything with word counts.
             if user_sprint['sprint_type'] == Sprint.TYPE_NO_WORDCOUNT:
 
                 # Just give them the completed sprint stat and XP.
-                await user.add_xp(Experience.XP_COMPLETE_SPRINT)
-                user.add_stat('sprints_completed', 1)
+                stats[user_id] = {'sprints_completed': 1}
 
                 # Push user to results.
                 results.append({
-                    'user': user,
+                    'user': user_id,
                     'wordcount': 0,
                     'xp': Experience.XP_COMPLETE_SPRINT,
                     'type': user_sprint['sprint_type']
@@ -416,10 +541,9 @@ class Sprint:
 
             else:
 
-                # If they didn't submit an ending word count, use their current one and update the DB row with it.
-                if user_sprint['ending_wc'] == 0:
+                # If they didn't submit an ending word count, use their current one. The DB rows are updated all at once below.
+                if int(user_sprint['ending_wc']) == 0:
                     user_sprint['ending_wc'] = user_sprint['current_wc']
-                    self.update_user(user_id, ending=user_sprint['ending_wc'])
 
                 # Now we only process their result if they have declared something and it's different to their starting word count.
                 user_sprint['starting_wc'] = int(user_sprint['starting_wc'])
@@ -438,42 +562,32 @@ class Sprint:
 
                     # Calculate the WPM from their time sprinted
                     wpm = Sprint.calculate_wpm(wordcount, time_sprinted)
+                    wpms[user_id] = wpm
 
-                    # See if it's a new record for the user
-                    user_record = user.get_record('wpm')
-                    wpm_record = True if user_record is None or wpm > int(user_record) else False
-
-                    # If it is a record, update their record in the database
-                    if wpm_record:
-                        user.update_record('wpm', wpm)
-
-                    # Give them XP for finishing the sprint
-                    await user.add_xp(Experience.XP_COMPLETE_SPRINT)
-
-                    # Increment their stats
-                    user.add_stat('sprints_completed', 1)
-                    user.add_stat('sprints_words_written', wordcount)
-                    user.add_stat('total_words_written', wordcount)
-
-                    # Increment their words towards their goal
-                    await user.add_to_goals(wordcount)
+                    # Increment their stats and their words towards their goals
+                    stats[user_id] = {'sprints_completed': 1, 'sprints_words_written': wordcount, 'total_words_written': wordcount}
+                    words[user_id] = wordcount
 
                     # If they were writing in a Project, update its word count.
                     if user_sprint['project'] is not None:
-                        project = Project(user_sprint['project'])
-                        project.words += wordcount
-                        project.save()
+                        projects[user_sprint['project']] = projects.get(user_sprint['project'], 0) + wordcount
 
                     # Push user to results
                     results.append({
-                        'user': user,
+                        'user': user_id,
                         'wordcount': wordcount,
                         'wpm': wpm,
-                        'wpm_record': wpm_record,
+                        'wpm_record': False,
                         'xp': Experience.XP_COMPLETE_SPRINT,
                         'type': user_sprint['sprint_type']
                     })
 
+        # See which of the WPMs are new personal bests.
+        records = await User.bulk_get_records('wpm', list(wpms.keys()))
+        pbs = {user_id: wpm for user_id, wpm in wpms.items() if records.get(user_id) is None or wpm > int(records[user_id])}
+        for result in results:
+            result['wpm_record'] = result['user'] in pbs
+
         # Sort the results.
         results = sorted(results, key=itemgetter('wordcount'), reverse=True)
 
@@ -493,56 +607,138 @@ class Sprint:
                     Experience.XP_WIN_SPRINT / (self.WINNING_POSITION if is_sprint_winner else position)
                 )
                 result['xp'] += extra_xp
-                await result['user'].add_xp(extra_xp)
 
             # If they actually won the sprint, increase their stat by 1
             # Since the results are in order, the highest word count will be set first
             # which means that any subsequent users with the same word count have tied for 1st place
             if position == 1 or result['wordcount'] == highest_word_count:
-                result['user'].add_stat('sprints_won', 1)
+                stats[result['user']]['sprints_won'] = 1
 
             position += 1
 
+        xp = {result['user']: result['xp'] for result in results}
+
+        # Dictionary of guild => goal and level up announcements for its users.
+        announcements = {}
+
+        # Write all the changes in one go.
+        # The sprint is marked as completed in the same transaction, so if anything fails, it can be completed again when the task is retried.
+        now = int(time.time())
+        async with db.transaction() as transaction:
+
+            # If it has been completed by something else in the meantime, its results have already been written.
+            if not await transaction.execute('UPDATE sprints SET completed = %s WHERE id = %s AND completed = 0', [now, self.id]):
+                return
+
+            # Only now we know we are the one completing it, print the "Results coming shortly" message.
+            await self.broadcast(lambda guild: ["The word counts are in. Results coming up shortly..."], context, bot, channels)
+
+            # Anyone who didn't submit an ending word count gets their current one.
+            await transaction.execute(
+                'UPDATE sprint_users SET ending_wc = current_wc WHERE sprint = %s AND ending_wc = 0 AND (sprint_type IS NULL OR sprint_type != %s)',
+                [self.id, Sprint.TYPE_NO_WORDCOUNT]
+            )
+
+            await User.bulk_update_records('wpm', pbs, transaction)
+            await Project.bulk_add_words(projects, transaction)
+
+            # Anyone who just met a goal gets the stat and XP for it.
+            for user_goal in await User.bulk_add_to_goals(words, transaction):
+                user_id = int(user_goal['user'])
+                stats[user_id][user_goal['type'] + '_goals_completed'] = 1
+                xp[user_id] += Experience.XP_COMPLETE_GOAL[user_goal['type']]
+                announcements.setdefault(guilds[user_id], []).append(f"<@{user_id}> has met their {user_goal['type']} goal of {user_goal['goal']} words!       +{Experience.XP_COMPLETE_GOAL[user_goal['type']]}xp!")
+
+            for user_id, level in (await User.bulk_add_xp(xp, transaction)).items():
+                announcements.setdefault(guilds[user_id], []).append(f":tada: Congratulations <@{user_id}>, you are now **Level {level}**")
+
+            # Stats go last, as some of them go into the StatBuffer, which can't be rolled back.
+            await User.bulk_add_stats(stats, transaction)
+
+        # Now the results are saved, remove it from the active sprints, here and in the other processes.
+        self.completed = now
+        registry = SprintRegistry.instance()
+        registry.update(self.guild, self.channel, {'completed': now})
+        registry.publish(self.guild, self.channel)
+        Leaderboard.discard(self.id)
+
         # Post the final message with the results
         if len(results) > 0:
 
             position = 1
-            message = ":trophy: **Sprint Results** :trophy:\nCongratulations to everyone.\n"
+            lines = [":trophy: **Sprint Results** :trophy:", "Congratulations to everyone."]
             for result in results:
 
                 if result['type'] == Sprint.TYPE_NO_WORDCOUNT:
-                    message = message + f"{result['user'].get_mention()}         +{result['xp']} xp"
+                    line = f"<@{result['user']}>         +{result['xp']} xp"
                 else:
-                    message = message + f"`{position}`. {result['user'].get_mention()} - **{result['wordcount']} words** ({result['wpm']} wpm)          +{result['xp']} xp"
+                    line = f"`{position}`. <@{result['user']}> - **{result['wordcount']} words** ({result['wpm']} wpm)          +{result['xp']} xp"
                     # If it's a new PB, append that string as well
                     if result['wpm_record'] is True:
-                        message = message + "          :champagne: **NEW PB**"
+                        line = line + "          :champagne: **NEW PB**"
 
-                message = message + '\n'
+                lines.append(line)
                 position += 1
 
         else:
-            message = "No-one submitted their word counts... I guess I'll just cancel the sprint... :frowning:"
+            lines = ["No-one submitted their word counts... I guess I'll just cancel the sprint... :frowning:"]
 
-        # Send the message, either via the context or directly to the channel.
-        await self.say(message, context, bot)
+        # Send the message to each channel, either via the context or directly, split up if it's too long for one message.
+        # Add the goal and level up announcements for that guild's users underneath, rather than posting each one separately.
+        for guild, channel in channels:
+            messages = lines + [''] + announcements[guild] if guild in announcements else lines
+            for message in self.__helper.split_message(messages):
+                await self.say(message, context, bot, channel=channel)
 
-    async def say(self, message, context = None, bot = None):
+    async def say(self, message, context = None, bot = None, allowed_mentions = None, channel = None):
         """
         Send a message to the channel, via context if supplied, or direct otherwise
         :param bot:
         :param message:
         :param context:
+        :param allowed_mentions: Which mentions in the message should ping, if not Discord's default of all of them
+        :param channel: The channel to send it to, if not the one the sprint was started in
         :return:
         """
-        if context is not None:
-            await context.send(message)
+        options = {} if allowed_mentions is None else {'allowed_mentions': allowed_mentions}
+        channel = str(channel if channel is not None else self.channel)
+
+        # The context can only reply in its own channel. Any other linked channels are sent to directly.
+        if context is not None and str(context.channel_id) == channel:
+            await context.send(message, **options)
             context.deferred = False
             return
-        elif bot is not None:
-            channel = await bot._http.get_channel(self.channel)
-            channel = interactions.Channel(**channel, _client=bot._http)
-            return await channel.send(message)
+
+        bot = bot if bot is not None else self.__bot
+        if bot is not None:
+            channel = await Channel.get(bot, channel)
+            return await channel.send(message, **options)
+
+    async def notify(self, segments, context = None, bot = None, channel = None):
+        """
+        Send a notification which mentions users, split across as many messages as it needs
+        :param segments: List of text and lists of user ids to mention, as taken by Notifier.build()
+        :param context:
+        :param bot:
+        :param channel: The channel to send it to, if not the one the sprint was started in
+        :return:
+        """
+        channel = str(channel if channel is not None else self.channel)
+        notifier = Notifier.instance()
+        await notifier.send(channel, notifier.build(*segments),
+                            lambda content, allowed_mentions: self.say(content, context, bot, allowed_mentions, channel))
+
+    async def broadcast(self, build, context = None, bot = None, channels = None):
+        """
+        Send a notification to every channel taking part in the sprint
+        :param build: function(guild) which returns the segments to send to that guild's channel, as taken by notify()
+        :param context:
+        :param bot:
+        :param channels: The channels to send it to, if they have already been looked up
+        :return:
+        """
+        for guild, channel in channels if channels is not None else self.get_channels():
+            await self.notify(build(guild), context, bot, channel)
 
     async def task_start(self, bot) -> bool:
         """
@@ -592,6 +788,55 @@ class Sprint:
         await self.complete_sprint(bot=bot)
         return True
 
+    @staticmethod
+    async def run_tasks(bot, ids, method):
+        """
+        Run a scheduled task method on a batch of sprints, loading all of them in one query
+        :param bot:
+        :param ids:
+        :param method:
+        :return: Dictionary of sprint id => result
+        """
+        sprints = Sprint.get_many(ids)
+
+        # If the sprint no longer exists (e.g. it was cancelled), there is nothing to do so the task is complete.
+        results = {id: True for id in ids if id not in sprints}
+        results.update(await Task.gather({id: getattr(sprint, method)(bot) for id, sprint in sprints.items()}))
+        return results
+
+    @staticmethod
+    @task_handler('sprint', 'start', batch=True)
+    async def task_start_all(bot, ids):
+        """
+        Scheduled task handler to start a batch of sprints
+        :param bot:
+        :param ids:
+        :return:
+        """
+        return await Sprint.run_tasks(bot, ids, 'task_start')
+
+    @staticmethod
+    @task_handler('sprint', 'end', batch=True)
+    async def task_end_all(bot, ids):
+        """
+        Scheduled task handler to end a batch of sprints
+        :param bot:
+        :param ids:
+        :return:
+        """
+        return await Sprint.run_tasks(bot, ids, 'task_end')
+
+    @staticmethod
+    @task_handler('sprint', 'complete', batch=True)
+    async def task_complete_all(bot, ids):
+        """
+        Scheduled task handler to complete a batch of sprints
+        :param bot:
+        :param ids:
+        :return:
+        """
+        return await Sprint.run_tasks(bot, ids, 'task_complete')
+
     @staticmethod
     def create(guild, channel, start, end, end_reference, length, createdby, created):
         """
@@ -621,8 +866,13 @@ class Sprint:
                   }
         )
 
-        # Return the new object using this guild id.
-        return Sprint(guild)
+        # Add it to the registry of active sprints.
+        registry = SprintRegistry.instance()
+        registry.set(db.get('sprints', {'id': db.last_insert_id()}))
+        registry.publish(guild, channel)
+
+        # Return the new object using this guild and channel id.
+        return Sprint(guild, channel)
 
     @staticmethod
     def calculate_wpm(amount: int, seconds: int) -> float:
@@ -642,41 +892,83 @@ class Sprint:
         :param context:
         :return:
         """
-        # Get a list of the members in this guild.
-        guild = await context.get_guild()
-        members = await guild.get_all_members()
-        guild_members = []
-        for member in members:
-            guild_members.append(int(member.id))
-
-        # Now go through those asking for notifications and see if they are in the list.
         db = Database.instance()
+        helper = Helper.instance()
+        guild_id = int(context.guild_id)
+
+        # Get the users asking for notifications. These are the only members we need to look for.
+        notify = db.get_all('user_settings', {'guild': guild_id, 'setting': 'sprint_notify', 'value': 1}, ['id', 'user'])
+        missing = {int(row['user']) for row in notify}
+
+        # Page through the members of the guild, crossing off each user we find, until we've found them all or run out.
+        after = 0
+        pages = 0
+        while missing:
+            members = await context._client.get_list_of_members(guild_id, limit=Sprint.MEMBER_PAGE_SIZE, after=after)
+            if not members:
+                break
+
+            ids = [int(member['user']['id']) for member in members]
+            missing.difference_update(ids)
+            after = max(ids)
+            pages += 1
+
+            if pages % Sprint.PURGE_PROGRESS_PAGES == 0:
+                helper.log(f"[SPRINT] Purging notifications in guild {guild_id}: scanned {pages * Sprint.MEMBER_PAGE_SIZE} members, {len(missing)} not found yet")
+
+            if len(members) < Sprint.MEMBER_PAGE_SIZE:
+                break
+
+        # Anyone we didn't find has left the server, so delete their settings.
+        stale = [row['id'] for row in notify if int(row['user']) in missing]
         count = 0
-        notify = db.get_all('user_settings', {'guild': int(context.guild_id), 'setting': 'sprint_notify', 'value': 1})
-        notify_ids = [int(row['user']) for row in notify]
-        if notify_ids:
+        for i in range(0, len(stale), Sprint.PURGE_CHUNK_SIZE):
+            chunk = stale[i:i + Sprint.PURGE_CHUNK_SIZE]
+            count += db.execute(f"DELETE FROM user_settings WHERE id IN {build_in(chunk)}", chunk)
 
-            # Go through the users who want notifications and delete any which aren't in the server now.
-            for row in notify:
-                user_id = int(row['user'])
-                if user_id not in guild_members:
-                    db.delete('user_settings', {'id': row['id']})
-                    count += 1
+        if pages >= Sprint.PURGE_PROGRESS_PAGES:
+            helper.log(f"[SPRINT] Purged {count} notification(s) in guild {guild_id} after scanning {pages} page(s) of members")
 
         return count
 
     @staticmethod
     def get(id):
         """
-        Get a sprint object by its id
-        :return: Sprint
+        Get an active sprint object by its id
+        :return: Sprint|None None if there is no sprint with that id which hasn't completed
         """
         db = Database.instance()
-        record = db.get('sprints', {'id': id})
+        record = db.get('sprints', {'id': id, 'completed': 0})
         if record is not None:
-            sprint = Sprint(None)
-            sprint.id = id
-            sprint.load('id')
-            return sprint
+            return Sprint(None, None, record=record)
         else:
-            return None
\ No newline at end of file
+            return None
+
+    @staticmethod
+    def get_by_code(code):
+        """
+        Get an active sprint by the code it was shared with
+        :param code:
+        :return: Sprint|None
+        """
+        db = Database.instance()
+        record = db.get('sprints', {'code': code, 'completed': 0})
+        if record is not None:
+            return Sprint(None, None, record=record)
+        else:
+            return None
+
+    @staticmethod
+    def get_many(ids):
+        """
+        Get the active sprints with the given ids, in one query
+        :param ids:
+        :return: Dictionary of sprint id => Sprint
+        """
+        if not ids:
+            return {}
+
+        db = Database.instance()
+        placeholders = ', '.join(['%s'] * len(ids))
+        records = db.get_all_sql(f"SELECT * FROM sprints WHERE id IN ({placeholders}) AND completed = 0", list(ids))
+        return {record['id']: Sprint(record['guild'], record['channel'], record=record) for record in records}
\ No newline at end of file
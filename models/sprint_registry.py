@@ -0,0 +1,219 @@
+from models.bus import Bus
+from models.database import Database
+from models.helper import Helper
+from models.singleton import Singleton
+
+@Singleton
+class SprintRegistry:
+    """
+    In-memory registry of the active sprints and the users taking part in them.
+    Each channel (or thread) can have its own sprint, so sprints are keyed on (guild, channel). A global sprint is also
+    keyed on each of the channels in other guilds which have been linked to it.
+    The database is still the source of truth. The registry is loaded from it on startup, and kept up to date by the
+    Sprint methods which change it, so that checking if there is a sprint in a channel, or if a user has joined it,
+    doesn't need a query. Other processes are told about changes through the Bus, and reload that sprint.
+    """
+
+    # Name the registry's invalidations are published under.
+    NAME = 'sprints'
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__db = Database.instance()
+        self.__helper = Helper.instance()
+
+        # Dictionary of sprint id => active sprints record.
+        self.__records = {}
+
+        # Dictionary of (guild, channel) => sprint id, for the channel each sprint was started in and any linked to it.
+        self.__sprints = {}
+
+        # Dictionary of sprint id => list of (guild, channel), starting with the channel it was started in.
+        self.__channels = {}
+
+        # Dictionary of sprint id => set of user ids taking part.
+        self.__users = {}
+
+        self.__loaded = False
+
+        Bus.instance().subscribe(self.NAME, self.reload)
+
+    def load(self):
+        """
+        Load all of the active sprints, their linked channels and their users from the database
+        :return: int The number of active sprints
+        """
+        self.__records = {}
+        self.__sprints = {}
+        self.__channels = {}
+        self.__users = {}
+
+        for record in self.__db.get_all('sprints', {'completed': 0}):
+            self.set(record)
+
+        records = self.__db.get_all_sql(
+            'SELECT sc.sprint, sc.guild, sc.channel FROM sprint_channels sc INNER JOIN sprints s ON s.id = sc.sprint WHERE s.completed = 0 ORDER BY sc.id', []
+        )
+        for record in records:
+            self.link(record['sprint'], record['guild'], record['channel'])
+
+        records = self.__db.get_all_sql(
+            'SELECT su.sprint, su.user FROM sprint_users su INNER JOIN sprints s ON s.id = su.sprint WHERE s.completed = 0', []
+        )
+        for record in records:
+            self.add_user(record['sprint'], record['user'])
+
+        self.__loaded = True
+        return len(self.__records)
+
+    @staticmethod
+    def key(guild, channel):
+        """
+        Get the key a channel's sprint is stored under
+        :param guild:
+        :param channel:
+        :return: tuple
+        """
+        return str(guild), str(channel)
+
+    def reload(self, key=None):
+        """
+        Reload a sprint from the database, e.g. when another process has changed it
+        :param key: The (guild, channel) it was started in, or None to reload everything
+        :return:
+        """
+        if key is None:
+            return self.load()
+
+        guild, channel = key
+        self.remove(guild, channel)
+
+        record = self.__db.get('sprints', {'guild': guild, 'channel': channel, 'completed': 0})
+        if record:
+            self.set(record)
+            for row in self.__db.get_all('sprint_channels', {'sprint': record['id']}, ['guild', 'channel'], ['id']):
+                self.link(record['id'], row['guild'], row['channel'])
+            for row in self.__db.get_all('sprint_users', {'sprint': record['id']}, ['user']):
+                self.add_user(record['id'], row['user'])
+
+    def get(self, guild, channel):
+        """
+        Get the active sprint record for a channel
+        :param guild:
+        :param channel:
+        :return: dict|None
+        """
+        if not self.__loaded:
+            self.load()
+
+        return self.__records.get(self.__sprints.get(self.key(guild, channel)))
+
+    def get_channels(self, sprint):
+        """
+        Get the channels taking part in a sprint
+        :param sprint:
+        :return: list of (guild, channel), starting with the channel it was started in
+        """
+        if not self.__loaded:
+            self.load()
+
+        return list(self.__channels.get(sprint, []))
+
+    def set(self, record):
+        """
+        Add or replace the active sprint record for its channel
+        :param record:
+        :return:
+        """
+        key = self.key(record['guild'], record['channel'])
+        self.__records[record['id']] = dict(record)
+        self.__sprints[key] = record['id']
+        self.__channels.setdefault(record['id'], [key])
+        self.__users.setdefault(record['id'], set())
+
+    def link(self, sprint, guild, channel):
+        """
+        Link a channel in another guild to a sprint
+        :param sprint:
+        :param guild:
+        :param channel:
+        :return:
+        """
+        key = self.key(guild, channel)
+        if sprint in self.__records and key not in self.__sprints:
+            self.__sprints[key] = sprint
+            self.__channels[sprint].append(key)
+
+    def update(self, guild, channel, params):
+        """
+        Update some of the fields of a channel's active sprint. If it has been marked as completed, it is removed.
+        :param guild:
+        :param channel:
+        :param params:
+        :return:
+        """
+        record = self.get(guild, channel)
+        if record is None:
+            return
+
+        record.update(params)
+        if record.get('completed'):
+            self.remove(guild, channel)
+
+    def remove(self, guild, channel):
+        """
+        Remove a channel's active sprint, along with its linked channels and its users
+        :param guild:
+        :param channel:
+        :return:
+        """
+        sprint = self.__sprints.get(self.key(guild, channel))
+        if sprint is None:
+            return
+
+        for key in self.__channels.pop(sprint, []):
+            self.__sprints.pop(key, None)
+
+        self.__records.pop(sprint, None)
+        self.__users.pop(sprint, None)
+
+    def add_user(self, sprint, user):
+        """
+        Add a user to a sprint
+        :param sprint:
+        :param user:
+        :return:
+        """
+        self.__users.setdefault(sprint, set()).add(int(user))
+
+    def remove_user(self, sprint, user):
+        """
+        Remove a user from a sprint
+        :param sprint:
+        :param user:
+        :return:
+        """
+        self.__users.get(sprint, set()).discard(int(user))
+
+    def has_user(self, sprint, user):
+        """
+        Check if a user is taking part in a sprint
+        :param sprint:
+        :param user:
+        :return: bool
+        """
+        if not self.__loaded:
+            self.load()
+
+        return int(user) in self.__users.get(sprint, ())
+
+    def publish(self, guild, channel):
+        """
+        Tell the other processes that a sprint has changed
+        :param guild: The guild the sprint was started in
+        :param channel: The channel the sprint was started in
+        :return:
+        """
+        Bus.instance().publish(self.NAME, self.key(guild, channel), local=False)
@@ -0,0 +1,103 @@
+import asyncio
+from models.database import Database
+from models.helper import Helper
+from models.singleton import Singleton
+from config import STAT_FLUSH_TIME, STAT_FLUSH_SIZE
+
+@Singleton
+class StatBuffer:
+    """
+    Write-behind buffer for the user stats which are incremented most often.
+    Increments are added up in memory per (user, stat), and written to the database in one batched upsert every few
+    seconds, or as soon as enough of them have built up. User.get_stat includes the unflushed amounts in its values.
+    """
+
+    # The stats which are buffered. Any other stats are written straight to the database.
+    STATS = ['total_words_written', 'sprints_words_written', 'sprints_completed', 'sprints_won']
+
+    def __init__(self):
+        """
+        Instantiate the object
+        """
+        self.__db = Database.instance()
+        self.__helper = Helper.instance()
+
+        # Dictionary of (user, stat) => amount waiting to be written.
+        self.__pending = {}
+
+        # How many times the buffer has been flushed. Users compare this to know if the stats they loaded are stale.
+        self.flushes = 0
+
+    def add(self, user, name, amount):
+        """
+        Add an increment for a user's stat to the buffer
+        :param user:
+        :param name:
+        :param amount:
+        :return:
+        """
+        key = (int(user), name)
+        self.__pending[key] = self.__pending.get(key, 0) + int(amount)
+
+        if len(self.__pending) >= STAT_FLUSH_SIZE:
+            self.flush()
+
+    def get(self, user, name):
+        """
+        Get the amount waiting to be added to a user's stat
+        :param user:
+        :param name:
+        :return: int
+        """
+        return self.__pending.get((int(user), name), 0)
+
+    def discard(self, user, name=None):
+        """
+        Throw away the amounts waiting to be added to a user's stats, e.g. when the stat is being reset
+        :param user:
+        :param name: The stat to discard, or None for all of them
+        :return:
+        """
+        for key in list(self.__pending.keys()):
+            if key[0] == int(user) and (name is None or key[1] == name):
+                del self.__pending[key]
+
+    def flush(self):
+        """
+        Write all of the buffered increments to the database in one query
+        :return: int The number of stats written
+        """
+        pending = self.__pending
+        self.__pending = {}
+
+        rows = [{'user': user, 'name': name, 'value': amount} for (user, name), amount in pending.items() if amount != 0]
+        if not rows:
+            return 0
+
+        try:
+            self.__db.upsert('user_stats', rows, ['value'], True)
+        except Exception as e:
+            # Put them back, adding on anything which was buffered while we were trying, so they go out with the next flush.
+            for key, amount in pending.items():
+                self.__pending[key] = self.__pending.get(key, 0) + amount
+            self.__helper.error(f"[STATS] Failed to flush {len(rows)} stats: {e}")
+            return 0
+
+        self.flushes += 1
+        return len(rows)
+
+    async def run(self):
+        """
+        Loop which flushes the buffer every few seconds
+        :return:
+        """
+        while True:
+            await asyncio.sleep(STAT_FLUSH_TIME)
+            self.flush()
+
+    def start(self):
+        """
+        Start the flush loop
+        :return:
+        """
+        return asyncio.get_event_loop().create_task(self.run())
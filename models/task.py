@@ -1,213 +1,453 @@
-import time
-from models.database import Database
-from models.helper import Helper
-from interactions.ext.tasks import IntervalTrigger, create_task
-
-# How many seconds between each call of the task loop.
-TASK_LOOP_TIME = 15
-
-class Task:
-
-    def __init__(self, id):
-        """
-        Load a Task object by its ID
-        :param id:
-        """
-        self.__db = Database.instance()
-        self.__helper = Helper.instance()
-        self.id = None
-
-        record = self.__db.get('tasks', {'id': id})
-        if record:
-            self.id = record['id']
-            self.type = record['type']
-            self.time = record['time']
-            self.object = record['object']
-            self.object_id = record['objectid']
-            self.processing = record['processing']
-            self.recurring = record['recurring']
-            self.run_every_seconds = record['runeveryseconds']
-
-    def is_valid(self):
-        """
-        Check if the Task object is valid
-        :return:
-        """
-        return self.id is not None
-
-    def is_recurring(self):
-        """
-        Check if the task is a recurring one or not
-        :return:
-        """
-        return int(self.recurring) == 1
-
-    def is_processing(self):
-        """
-        Check if this task is already running
-        :return:
-        """
-        return self.processing == 1
-
-    def start_processing(self, value):
-        """
-        Mark the task as processing or not
-        :param value: 0 or 1
-        :return:
-        """
-        return self.__db.update('tasks', {'processing': value}, {'id': self.id})
-
-    def set_recur(self):
-        """
-        Set the next time this recurring task should be run
-        :return:
-        """
-        now = int(time.time())
-        next = now + int(self.run_every_seconds)
-        return self.__db.update('tasks', {'time': next}, {'id': self.id})
-
-    def delete(self):
-        """
-        Delete the task
-        :return:
-        """
-        return self.__db.delete('tasks', {'id': self.id})
-
-    async def run(self, bot):
-        """
-        Run the task
-        :param bot:
-        :return:
-        """
-        # If the task is already processing, don't go any further.
-        if self.is_processing():
-            return True
-
-        # Mark the task as processing so other shards don't pick it up.
-        self.start_processing(1)
-
-        # Build a variable to store the method name to run
-        method = 'task_' + str(self.type)
-
-        # Start off with a False and see if we can successfully run and turn that to True
-        result = False
-
-        if self.object == 'goal':
-
-            from models.goal import Goal
-
-            goal = Goal()
-            result = await getattr(goal, method)(bot)
-
-        elif self.object == 'sprint':
-
-            from models.sprint import Sprint
-
-            sprint = Sprint.get(self.object_id)
-            if sprint.is_valid():
-                result = await getattr(sprint, method)(bot)
-            else:
-                result = True
-
-        else:
-            self.__helper.error('Invalid task object: ' + str(self.object))
-
-        # If we finished the task, and it's not a recurring one, delete it.
-        if result is True and not self.is_recurring():
-            self.delete()
-        else:
-            self.start_processing(0)
-
-        # If it's a recurring task, set its next run time.
-        if self.is_recurring():
-            self.set_recur()
-
-        return result
-
-    @staticmethod
-    def cancel(object, object_id, type=None):
-        """
-        Cancel all tasks related to a specific object
-        :param object:
-        :param object_id:
-        :param type:
-        :return:
-        """
-        db = Database.instance()
-
-        params = {'object': object, 'objectid': object_id}
-        if type is not None:
-            params['type'] = type
-
-        return db.delete('tasks', params)
-
-    @staticmethod
-    def get(type, object, object_id):
-        """
-        Check to see if a task of this type and object_id already exists
-        :return:
-        """
-        db = Database.instance()
-        return db.get('tasks', {'type': type, 'object': object, 'objectid': object_id})
-
-    @staticmethod
-    def schedule(type, time, object, object_id):
-        """
-        Schedule the task in the database
-        :return:
-        """
-        db = Database.instance()
-
-        # If this task already exists, just update its time.
-        record = Task.get(type, object, object_id)
-        if record:
-            return db.update('tasks', {'time': time}, {'id': record['id']})
-        else:
-            # Otherwise, create one.
-            return db.insert('tasks', {'type': type, 'time': time, 'object': object, 'objectid': object_id})
-
-    @staticmethod
-    def setup(bot):
-        """
-        Setup the tasks to run in the background
-        :param bot:
-        :return:
-        """
-        db = Database.instance()
-
-        # Setup the task records for Goal.
-        from models.goal import Goal
-        Goal.setup_tasks()
-
-        # Restart all tasks which are marked as processing, in case the bot dropped out during the process.
-        db.update('tasks', {'processing': 0})
-
-
-    @staticmethod
-    async def run_all(bot):
-        """
-        Start running all of the tasks that need running
-        :param bot:
-        :return:
-        """
-        now = int(time.time())
-        db = Database.instance()
-
-        pending = db.get_all_sql('SELECT id FROM tasks WHERE time <= %s ORDER BY id ASC', [now])
-        for row in pending:
-            task = Task(row['id'])
-            if task.is_valid():
-                await task.run(bot)
-
-    @create_task(IntervalTrigger(TASK_LOOP_TIME))
-    async def all(bot):
-        """
-        Start the task loop
-        :return:
-        """
-        helper = Helper.instance()
-        helper.log('[TASK] Checking for pending tasks...')
-
-        # Run all of the tasks
-        await Task.run_all(bot)
-
+import asyncio, importlib, os, socket, time, traceback, uuid, weakref
+from contextlib import AsyncExitStack
+from models.async_database import AsyncDatabase
+from models.database import Database
+from models.helper import Helper
+from models.scheduler import Scheduler
+from config import TASK_CONCURRENCY
+
+# How many seconds to wait before trying a task again, if it didn't complete.
+# This doubles with each failed attempt.
+TASK_RETRY_TIME = 15
+
+# How many times to try a task before giving up on it and moving it to the tasks_dead table.
+TASK_MAX_ATTEMPTS = 5
+
+# How many seconds a task can run for before it is cancelled and counted as a failed attempt.
+TASK_TIMEOUT = 120
+
+# How many seconds a claim on a task lasts before another process is allowed to take it over.
+# While a task is running, its lease is renewed every third of this.
+TASK_LEASE_TIME = 60
+
+# Unique ID for this process, used to mark which tasks it has claimed.
+TASK_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# The modules which register task handlers. These are imported once, in Task.setup.
+TASK_HANDLER_MODULES = ['models.goal', 'models.sprint']
+
+# The registered task handlers, keyed by (object, type). Each one is a tuple of (function, batch).
+TASK_HANDLERS = {}
+
+def task_handler(object, type, batch=False):
+    """
+    Decorator to register a function as the handler for a type of task.
+    Normal handlers are called as `handler(bot, object_id)` and return True once the task is complete.
+    Batch handlers are called once with all the due tasks of that type, as `handler(bot, object_ids)`, and return a
+    dictionary of object_id => result. A result can also be the exception raised for that object, which only counts
+    as a failed attempt for that one task.
+    :param object:
+    :param type:
+    :param batch:
+    :return:
+    """
+    def register(function):
+        TASK_HANDLERS[(object, type)] = (function, batch)
+        return function
+    return register
+
+class Task:
+
+    # Semaphore shared by all running tasks, to limit how many run at once.
+    SEMAPHORE = None
+
+    # Locks for the objects which have tasks running, keyed by (object, object_id). Batches run concurrently, so this
+    # stops tasks for the same object (e.g. a sprint's start and end) from running at the same time in different batches.
+    LOCKS = weakref.WeakValueDictionary()
+
+    def __init__(self, id, record=None):
+        """
+        Load a Task object by its ID
+        :param id:
+        :param record: The tasks record, if it has already been loaded, to save loading it again
+        """
+        self.__db = AsyncDatabase.instance()
+        self.__helper = Helper.instance()
+        self.id = None
+
+        if record is None:
+            record = Database.instance().get('tasks', {'id': id})
+
+        if record:
+            self.id = record['id']
+            self.type = record['type']
+            self.time = record['time']
+            self.object = record['object']
+            self.object_id = record['objectid']
+            self.processing = record['processing']
+            self.recurring = record['recurring']
+            self.run_every_seconds = record['runeveryseconds']
+            self.attempts = record['attempts']
+
+    def is_valid(self):
+        """
+        Check if the Task object is valid
+        :return:
+        """
+        return self.id is not None
+
+    def is_recurring(self):
+        """
+        Check if the task is a recurring one or not
+        :return:
+        """
+        return int(self.recurring) == 1
+
+    def is_processing(self):
+        """
+        Check if this task is already running
+        :return:
+        """
+        return self.processing == 1
+
+    async def release(self):
+        """
+        Release this process's claim on the task, so it can be picked up again
+        :return:
+        """
+        return await self.__db.update('tasks', {'processing': 0, 'owner': None, 'lease_expires': 0}, {'id': self.id})
+
+    async def set_recur(self):
+        """
+        Set the next time this recurring task should be run
+        :return:
+        """
+        now = int(time.time())
+        next = now + int(self.run_every_seconds)
+        Scheduler.instance().schedule(self.id, next)
+        return await self.__db.update('tasks', {'time': next}, {'id': self.id})
+
+    async def delete(self):
+        """
+        Delete the task
+        :return:
+        """
+        Scheduler.instance().cancel(self.id)
+        return await self.__db.delete('tasks', {'id': self.id})
+
+    async def run(self, bot):
+        """
+        Run the task on its own, with a timeout. If it fails, it is retried with an increasing delay.
+        :param bot:
+        :return:
+        """
+        handler = TASK_HANDLERS.get((self.object, self.type))
+        if handler is None:
+            return await self.fail(f"No handler registered for {self.object}/{self.type}")
+
+        function, batch = handler
+        try:
+            result = await asyncio.wait_for(function(bot, self.object_id), TASK_TIMEOUT)
+        except Exception as e:
+            result = e
+
+        return await self.finish(result)
+
+    async def finish(self, result):
+        """
+        Finish the task, given the result of its handler
+        :param result: True if it completed, otherwise False or the exception it raised
+        :return:
+        """
+        if isinstance(result, asyncio.TimeoutError):
+            return await self.fail(f"Timed out after {TASK_TIMEOUT} seconds")
+
+        if isinstance(result, BaseException):
+            return await self.fail(''.join(traceback.format_exception(type(result), result, result.__traceback__)))
+
+        # If it didn't finish, count that as a failed attempt as well.
+        if result is not True:
+            return await self.fail('Task did not complete')
+
+        # If we finished the task, and it's not a recurring one, delete it.
+        # Unless the handler rescheduled it while it was running, in which case keep it for its new time.
+        if not self.is_recurring():
+            if await self.__db.delete('tasks', {'id': self.id, 'time': self.time}):
+                Scheduler.instance().cancel(self.id)
+            else:
+                await self.release()
+        else:
+            # If it's a recurring task, set its next run time.
+            await self.set_recur()
+            await self.release()
+
+        return result
+
+    async def fail(self, error):
+        """
+        Record a failed attempt at running the task.
+        It is rescheduled with exponential backoff, unless it has used up all its attempts, in which case it is moved to the tasks_dead table.
+        Recurring tasks are never moved, they just wait for their next run.
+        :param error:
+        :return: bool
+        """
+        attempts = int(self.attempts) + 1
+        self.__helper.error(f"[TASK] Task {self.id} ({self.object}/{self.type} {self.object_id}) failed on attempt {attempts}: {error}")
+
+        if self.is_recurring():
+            await self.set_recur()
+            await self.release()
+
+        elif attempts >= TASK_MAX_ATTEMPTS:
+            await self.__db.insert('tasks_dead', {
+                'task': self.id,
+                'time': self.time,
+                'type': self.type,
+                'object': self.object,
+                'objectid': self.object_id,
+                'attempts': attempts,
+                'error': error,
+                'failed': int(time.time())
+            })
+            await self.delete()
+
+        else:
+            next = int(time.time()) + TASK_RETRY_TIME * (2 ** (attempts - 1))
+            await self.__db.update('tasks', {'time': next, 'attempts': attempts, 'processing': 0, 'owner': None, 'lease_expires': 0}, {'id': self.id})
+            Scheduler.instance().schedule(self.id, next)
+
+        return False
+
+    @staticmethod
+    def cancel(object, object_id, type=None):
+        """
+        Cancel all tasks related to a specific object
+        :param object:
+        :param object_id:
+        :param type:
+        :return:
+        """
+        db = Database.instance()
+        scheduler = Scheduler.instance()
+
+        params = {'object': object, 'objectid': object_id}
+        if type is not None:
+            params['type'] = type
+
+        # Remove them from the scheduler as well as the database.
+        for record in db.get_all('tasks', params, ['id']):
+            scheduler.cancel(record['id'])
+
+        return db.delete('tasks', params)
+
+    @staticmethod
+    def get(type, object, object_id):
+        """
+        Check to see if a task of this type and object_id already exists
+        :return:
+        """
+        db = Database.instance()
+        return db.get('tasks', {'type': type, 'object': object, 'objectid': object_id})
+
+    @staticmethod
+    def schedule(type, time, object, object_id):
+        """
+        Schedule the task in the database
+        :return:
+        """
+        db = Database.instance()
+
+        # If this task already exists, just update its time.
+        record = Task.get(type, object, object_id)
+        if record:
+            result = db.update('tasks', {'time': time, 'attempts': 0}, {'id': record['id']})
+            id = record['id']
+        else:
+            # Otherwise, create one.
+            result = db.insert('tasks', {'type': type, 'time': time, 'object': object, 'objectid': object_id})
+            id = db.last_insert_id()
+
+        # Add it to the scheduler, so the loop wakes up for it.
+        Scheduler.instance().schedule(id, time)
+        return result
+
+    @staticmethod
+    def setup(bot):
+        """
+        Setup the tasks to run in the background
+        :param bot:
+        :return:
+        """
+        # Import the modules with task handlers, so they are registered.
+        for module in TASK_HANDLER_MODULES:
+            importlib.import_module(module)
+
+        # Setup the task records for Goal.
+        from models.goal import Goal
+        Goal.setup_tasks()
+
+        # Tasks which were being processed when the bot dropped out are not reset here. Their leases will expire and
+        # then they can be claimed again, without interfering with any tasks which other processes are still running.
+        # The pending tasks are loaded into the scheduler when its loop starts.
+
+    @staticmethod
+    async def run_all(bot, ids):
+        """
+        Run all of the tasks which the scheduler says are due
+        :param bot:
+        :param ids:
+        :return:
+        """
+        helper = Helper.instance()
+        started = time.time()
+
+        # Claim the tasks, so that no other process runs them at the same time.
+        tasks = await Task.claim(ids)
+        helper.log(f"[TASK] Running {len(tasks)}/{len(ids)} pending task(s)...")
+        if not tasks:
+            return
+
+        # Tasks for the same object (e.g. a sprint's start and end) have to run one after the other, in the order they
+        # were due. So split them into rounds, where each round has at most one task for each object.
+        rounds = []
+        counts = {}
+        for task in tasks:
+            index = counts.get((task.object, task.object_id), 0)
+            counts[(task.object, task.object_id)] = index + 1
+            if index == len(rounds):
+                rounds.append([])
+            rounds[index].append(task)
+
+        lag = []
+
+        # Keep renewing the leases on the tasks until we have finished running them.
+        renewer = asyncio.get_event_loop().create_task(Task.renew_leases())
+
+        try:
+            async with AsyncExitStack() as locks:
+
+                # Wait for any other batches running tasks for the same objects to finish. The locks are always taken in
+                # the same order, so two batches can't each be waiting on the other.
+                for key in sorted({(task.object, str(task.object_id)) for task in tasks}):
+                    lock = Task.LOCKS.get(key)
+                    if lock is None:
+                        lock = Task.LOCKS[key] = asyncio.Lock()
+                    await locks.enter_async_context(lock)
+
+                for current in rounds:
+
+                    # Group the round's tasks by handler, so batch handlers get all their tasks in one call.
+                    groups = {}
+                    for task in current:
+                        lag.append(time.time() - task.time)
+                        groups.setdefault((task.object, task.type), []).append(task)
+
+                    await asyncio.gather(*[Task.run_group(bot, key, group) for key, group in groups.items()])
+        finally:
+            renewer.cancel()
+
+        # Log how late the tasks started compared to when they were scheduled.
+        helper.log(f"[TASK] Ran {len(tasks)} task(s) in {round(time.time() - started, 2)}s. "
+                   f"Start lag: avg {round(sum(lag) / len(lag), 2)}s, max {round(max(lag), 2)}s")
+
+    @staticmethod
+    async def run_group(bot, key, tasks):
+        """
+        Run a group of tasks which all have the same object and type
+        :param bot:
+        :param key: tuple of (object, type)
+        :param tasks:
+        :return:
+        """
+        handler = TASK_HANDLERS.get(key)
+
+        # If it's a normal handler, or there isn't one, just run each task concurrently.
+        if handler is None or not handler[1]:
+            async def run(task):
+                async with Task.get_semaphore():
+                    await task.run(bot)
+            return await asyncio.gather(*[run(task) for task in tasks])
+
+        # Otherwise, pass them all to the batch handler at once.
+        function, batch = handler
+        try:
+            results = await function(bot, [task.object_id for task in tasks])
+        except Exception:
+            error = traceback.format_exc()
+            for task in tasks:
+                await task.fail(error)
+            return
+
+        for task in tasks:
+            await task.finish(results.get(task.object_id, False))
+
+    @staticmethod
+    async def gather(calls):
+        """
+        Used by batch handlers to run a coroutine for each object concurrently, with the same concurrency limit and
+        timeout as individual tasks.
+        :param calls: Dictionary of object_id => coroutine
+        :return: Dictionary of object_id => result, or the exception it raised
+        """
+        async def run(call):
+            async with Task.get_semaphore():
+                return await asyncio.wait_for(call, TASK_TIMEOUT)
+
+        results = await asyncio.gather(*[run(call) for call in calls.values()], return_exceptions=True)
+        return dict(zip(calls.keys(), results))
+
+    @staticmethod
+    def get_semaphore():
+        """
+        Get the semaphore which limits how many tasks run at once
+        :return: asyncio.Semaphore
+        """
+        if Task.SEMAPHORE is None:
+            Task.SEMAPHORE = asyncio.Semaphore(TASK_CONCURRENCY)
+        return Task.SEMAPHORE
+
+    @staticmethod
+    async def claim(ids):
+        """
+        Atomically claim a set of due tasks for this process.
+        A task can be claimed if it is due and isn't being processed, or if the process which claimed it has let its
+        lease expire. Any tasks which are still leased by another process are put back in the scheduler for when their
+        lease expires, in case that process has died. Any which have been moved to a later time, e.g. by another process
+        we didn't hear from, are put back in for that time.
+        :param ids:
+        :return: list The claimed Task objects, in the order they were due
+        """
+        if not ids:
+            return []
+
+        db = AsyncDatabase.instance()
+        now = int(time.time())
+        lease = now + TASK_LEASE_TIME
+        placeholders = ', '.join(['%s'] * len(ids))
+
+        await db.execute(
+            f"UPDATE tasks SET processing = 1, owner = %s, lease_expires = %s WHERE id IN ({placeholders}) AND time <= %s AND (processing = 0 OR lease_expires < %s)",
+            [TASK_OWNER, lease] + list(ids) + [now, now]
+        )
+
+        claimed = {}
+        records = await db.get_all_sql(f"SELECT * FROM tasks WHERE id IN ({placeholders})", list(ids))
+        for record in records:
+            if record['owner'] == TASK_OWNER and record['lease_expires'] == lease:
+                claimed[record['id']] = Task(record['id'], record)
+            elif record['processing'] == 1:
+                Scheduler.instance().push(record['id'], max(record['time'], record['lease_expires'] + 1))
+            else:
+                Scheduler.instance().push(record['id'], record['time'])
+
+        return [claimed[id] for id in ids if id in claimed]
+
+    @staticmethod
+    async def renew_leases():
+        """
+        Renew the leases on all the tasks this process is running, until cancelled
+        :return:
+        """
+        db = AsyncDatabase.instance()
+        while True:
+            await asyncio.sleep(TASK_LEASE_TIME / 3)
+            await db.update('tasks', {'lease_expires': int(time.time()) + TASK_LEASE_TIME}, {'owner': TASK_OWNER, 'processing': 1})
+
+    @staticmethod
+    def start(bot):
+        """
+        Start the scheduler loop, which runs each task as soon as it is due
+        :param bot:
+        :return:
+        """
+        return asyncio.get_event_loop().create_task(Scheduler.instance().run(bot, Task.run_all))
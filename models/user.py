@@ -1,10 +1,22 @@
 import math, time
-from models.database import Database
+from types import MappingProxyType
+from models.async_database import AsyncDatabase
+from models.bus import Bus
+from models.cache import Cache
+from models.channel import Channel
+from models.database import Database, build_case, build_in
 from models.helper import Helper
 from models.experience import Experience
+from models.goal import Goal
+from models.profile import Profile
+from models.stat_buffer import StatBuffer
+from config import USER_CACHE_TTL, USER_CACHE_SIZE
 
 class User:
 
+    # Cache of user id => settings, shared by all User objects.
+    SETTINGS_CACHE = Cache('user_settings', ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE)
+
     def __init__(self, id, guild_id, context=None, bot=None, channel=None):
 
         self.__db = Database.instance()
@@ -17,6 +29,7 @@ class User:
         self.guild_id = str(guild_id)
         self.settings = None
         self.stats = None
+        self.stats_flushes = None
         self.xp = None
         self.records = None
 
@@ -38,9 +51,8 @@ class User:
             await self.__context.send(message)
             self.__context.deferred = False
             return
-        elif self.__bot is not None:
-            channel = await self.__bot._http.get_channel(self.channel)
-            channel = interactions.Channel(**channel, _client=self.__bot._http)
+        elif self.__bot is not None and self.__channel is not None:
+            channel = await Channel.get(self.__bot, self.__channel)
             return await channel.send(message)
 
     def get_settings(self):
@@ -74,9 +86,13 @@ class User:
 
     def load_settings(self):
         """
-        Load all of the user's settings from the database
+        Load all of the user's settings from the cache, or from the database if they aren't cached
         :return:
         """
+        cached = User.SETTINGS_CACHE.get(self.id)
+        if cached is not None:
+            self.settings = dict(cached)
+            return
 
         # Get the user_settings records
         records = self.__db.get_all('user_settings', {'user': self.id})
@@ -88,6 +104,8 @@ class User:
         for row in records:
             self.settings[row['setting']] = row['value']
 
+        User.SETTINGS_CACHE.set(self.id, dict(self.settings))
+
     def update_setting(self, setting, value):
         """
         Update the value of a setting for this user
@@ -103,11 +121,15 @@ class User:
         self.settings[setting] = value
 
         if user_setting:
-            return self.__db.update('user_settings', {'value': value}, {'user': self.id, 'setting': setting})
+            result = self.__db.update('user_settings', {'value': value}, {'user': self.id, 'setting': setting})
 
         # Otherwise, we want to insert a new one
         else:
-            return self.__db.insert('user_settings', {'user': self.id, 'setting': setting, 'value': value})
+            result = self.__db.insert('user_settings', {'user': self.id, 'setting': setting, 'value': value})
+
+        # Remove the old settings from the cache in all processes.
+        Bus.instance().publish(User.SETTINGS_CACHE.name, self.id)
+        return result
 
     def get_guild_setting(self, guild, setting):
         """
@@ -128,12 +150,70 @@ class User:
         :param str value:
         :return: Result of update or insert query
         """
-        result = self.get_guild_setting(guild, setting)
-        if result:
-            return self.__db.update('user_settings', {'value': value}, {'id': result['id']})
+        record = self.get_guild_setting(guild, setting)
+        if record:
+            result = self.__db.update('user_settings', {'value': value}, {'id': record['id']})
         else:
-            return self.__db.insert('user_settings',
-                                    {'user': self.id, 'guild': str(guild), 'setting': setting, 'value': value})
+            result = self.__db.insert('user_settings',
+                                      {'user': self.id, 'guild': str(guild), 'setting': setting, 'value': value})
+
+        # Remove the old settings from the cache in all processes.
+        Bus.instance().publish(User.SETTINGS_CACHE.name, self.id)
+        return result
+
+    def load_profile(self):
+        """
+        Load the user's stats, records, XP and settings all in one query.
+        The stats, records and XP are also stored on the object, so any other get_stat(), get_xp(), etc... calls don't
+        need to load them again. The settings are the same ones load_settings() gets, and come from the settings cache
+        if they are in it, otherwise they are loaded in the same query and cached.
+        :return: Profile A read-only snapshot of them
+        """
+        sql = "SELECT 'stat' AS kind, name, value, NULL AS text FROM user_stats WHERE user = %s " \
+              "UNION ALL SELECT 'record', record, value, NULL FROM user_records WHERE user = %s " \
+              "UNION ALL SELECT 'xp', id, xp, NULL FROM user_xp WHERE user = %s"
+        params = [self.id, self.id, self.id]
+
+        cached = User.SETTINGS_CACHE.get(self.id)
+        if cached is None:
+            sql += " UNION ALL SELECT 'setting', setting, NULL, value FROM user_settings WHERE user = %s"
+            params.append(self.id)
+
+        records = self.__db.get_all_sql(sql, params)
+
+        buffer = StatBuffer.instance()
+        self.stats = {}
+        self.stats_flushes = buffer.flushes
+        self.records = {}
+        settings = dict(cached) if cached is not None else {}
+
+        for row in records:
+            if row['kind'] == 'stat':
+                self.stats[row['name']] = int(row['value'] or 0)
+            elif row['kind'] == 'record':
+                self.records[row['name']] = row['value']
+            elif row['kind'] == 'setting':
+                settings[row['name']] = row['text']
+            elif row['kind'] == 'xp':
+                experience = Experience(int(row['value']))
+                self.xp = {'id': int(row['name']), 'xp': experience.xp, 'lvl': experience.get_level(),
+                           'next': experience.get_next_level_xp()}
+
+        if cached is None:
+            User.SETTINGS_CACHE.set(self.id, dict(settings))
+
+        # Include anything still waiting in the stat buffer.
+        stats = {name: self.get_stat(name) for name in set(self.stats) | set(StatBuffer.STATS)}
+
+        return Profile(
+            user=self.id,
+            stats=MappingProxyType(stats),
+            records=MappingProxyType(dict(self.records)),
+            settings=MappingProxyType(settings),
+            xp=self.xp['xp'] if self.xp else None,
+            lvl=self.xp['lvl'] if self.xp else None,
+            next=self.xp['next'] if self.xp else None
+        )
 
     def get_stat(self, name):
         """
@@ -142,15 +222,18 @@ class User:
         :return:
         """
 
-        # If the stats property is None, then load it up first
-        if self.stats is None:
+        buffer = StatBuffer.instance()
+
+        # If the stats property is None, then load it up first. Also reload it if the buffer has been flushed since,
+        # otherwise the amounts which were flushed would be missing from it.
+        if self.stats is None or self.stats_flushes != buffer.flushes:
             self.load_stats()
 
-        # Now check if the key exists in the dictionary
+        # Now check if the key exists in the dictionary, and add on anything which hasn't been written yet
         if name in self.stats:
-            return self.stats[name]
+            return int(self.stats[name] or 0) + buffer.get(self.id, name)
         else:
-            return 0
+            return buffer.get(self.id, name)
 
     def load_stats(self):
         """
@@ -160,6 +243,7 @@ class User:
 
         # Get the user_stats records
         records = self.__db.get_all('user_stats', {'user': self.id})
+        self.stats_flushes = StatBuffer.instance().flushes
 
         # Reset the stats property
         self.stats = {}
@@ -175,36 +259,64 @@ class User:
         :param amount:
         :return:
         """
+        # Anything still waiting in the buffer would be added on top of the new value, so throw it away.
+        StatBuffer.instance().discard(self.id, name)
+        self.__db.upsert('user_stats', {'user': self.id, 'name': name, 'value': amount}, ['value'])
 
-        # If the user already has a value for this stat, we want to update
-        user_stat = self.get_stat(name)
-
-        # Update the value in the array
-        self.stats[name] = amount
-
-        if user_stat:
-            return self.__db.update('user_stats', {'value': amount}, {'user': self.id, 'name': name})
+        # Update the value in the array, if it's been loaded
+        if self.stats is not None:
+            self.stats[name] = amount
 
-        # Otherwise, we want to insert a new one
-        else:
-            return self.__db.insert('user_stats', {'user': self.id, 'name': name, 'value': amount})
+        return amount
 
     def add_stat(self, name, amount):
         """
         Increment a specific stat for the user
         :param name:
         :param amount:
-        :return:
+        :return: int The new value of the stat
+        """
+        return self.add_stats({name: amount})[name]
+
+    def add_stats(self, stats):
+        """
+        Increment multiple stats for the user at once.
+        The increments are done in the database, so they are not lost if the user is being updated somewhere else at the same time.
+        The most frequently updated stats go into the StatBuffer instead, and are written in batches.
+        :param stats: Dictionary of stat name => amount
+        :return: dict The new values of the stats
         """
+        buffer = StatBuffer.instance()
+        values = {}
+
+        rows = []
+        for name, amount in stats.items():
+            if name in StatBuffer.STATS:
+                buffer.add(self.id, name, amount)
+            else:
+                rows.append({'user': self.id, 'name': name, 'value': int(amount)})
+
+        if rows:
+            self.__db.upsert('user_stats', rows, ['value'], True)
+
+            # Get the new values back out.
+            names = [row['name'] for row in rows]
+            placeholders = ', '.join(['%s'] * len(names))
+            records = self.__db.get_all_sql(f"SELECT name, value FROM user_stats WHERE user = %s AND name IN ({placeholders})",
+                                            [self.id] + names)
 
-        # If the user already has a value for this stat, we want to get their current amount so we can increment it
-        user_stat = self.get_stat(name)
+            values = {row['name']: row['value'] for row in records}
 
-        if user_stat:
-            amount = int(amount) + int(user_stat)
+            # Update the values in the array, if it's been loaded
+            if self.stats is not None:
+                self.stats.update(values)
 
-        # Now return the update_stat with the new amount (if incremented)
-        return self.update_stat(name, amount)
+        # The buffered ones are their stored value plus whatever is still waiting to be written.
+        for name in stats:
+            if name in StatBuffer.STATS:
+                values[name] = self.get_stat(name)
+
+        return values
 
     def get_xp(self):
         """
@@ -241,17 +353,24 @@ class User:
         else:
             return '-'
 
-    def add_xp(self, amount):
+    async def add_xp(self, amount):
         """
         Add XP to the user
         :param amount:
         :return:
         """
+        result = self.__db.upsert('user_xp', {'user': self.id, 'xp': int(amount)}, ['xp'], True)
+
+        # Reload the XP, and work out what level they were before from how much we just added
+        self.load_xp()
         user_xp = self.get_xp()
-        if user_xp:
-            amount += int(user_xp['xp'])
+        current_level = Experience(max(user_xp['xp'] - int(amount), 0)).get_level()
 
-        return self.update_xp(amount)
+        # If the level now is higher than it was, print the level up message
+        if user_xp['lvl'] > current_level:
+            await self.say(f":tada: Congratulations {self.get_mention()}, you are now **Level {user_xp['lvl']}**")
+
+        return result
 
     async def update_xp(self, amount):
         """
@@ -260,15 +379,9 @@ class User:
         :return:
         """
         user_xp = self.get_xp()
+        current_level = user_xp['lvl'] if user_xp else 1
 
-        # If they already have an XP record, update it
-        if user_xp:
-            current_level = user_xp['lvl']
-            result = self.__db.update('user_xp', {'xp': amount}, {'id': user_xp['id']})
-        else:
-            # Otherwise, insert a new one
-            current_level = 1
-            result = self.__db.insert('user_xp', {'user': self.id, 'xp': amount})
+        result = self.__db.upsert('user_xp', {'user': self.id, 'xp': amount}, ['xp'])
 
         # Reload the XP onto the user object and into the user_xp variable
         self.load_xp()
@@ -356,19 +469,13 @@ class User:
         :param value:
         :return:
         """
+        self.__db.upsert('user_records', {'user': self.id, 'record': name, 'value': value}, ['value'])
 
-        # If the user already has a value for this record, we want to update
-        user_record = self.get_record(name)
-
-        # Update the value in the array
-        self.records[name] = value
-
-        if user_record:
-            return self.__db.update('user_records', {'value': value}, {'user': self.id, 'record': name})
+        # Update the value in the array, if it's been loaded
+        if self.records is not None:
+            self.records[name] = value
 
-        # Otherwise, we want to insert a new one
-        else:
-            return self.__db.insert('user_records', {'user': self.id, 'record': name, 'value': value})
+        return value
 
     def reset_projects(self):
         """
@@ -382,6 +489,7 @@ class User:
         Reset the entire user's stats, records, xp, etc...
         :return:
         """
+        StatBuffer.instance().discard(self.id)
         self.__db.delete('user_challenges', {'user': self.id})
         self.__db.delete('user_goals', {'user': self.id})
         self.__db.delete('user_records', {'user': self.id})
@@ -454,11 +562,30 @@ class User:
         next_reset = self.calculate_user_reset_time(type)
 
         if user_goal:
-            return self.__db.update('user_goals', {'goal': value, 'reset': next_reset}, {'id': user_goal['id']})
+            result = self.__db.update('user_goals', {'goal': value, 'reset': next_reset}, {'id': user_goal['id']})
         else:
-            return self.__db.insert('user_goals',
-                                    {'type': type, 'goal': value, 'user': self.id, 'current': 0, 'completed': 0,
-                                     'reset': next_reset})
+            result = self.__db.insert('user_goals',
+                                      {'type': type, 'goal': value, 'user': self.id, 'current': 0, 'completed': 0,
+                                       'reset': next_reset})
+
+        # Make sure the reset task will run in time for this goal.
+        Goal.schedule_reset(next_reset)
+        return result
+
+    def update_goal_resets(self):
+        """
+        Recalculate the reset times of all the user's goals, e.g. after they change their timezone
+        :return:
+        """
+        resets = []
+        for user_goal in self.__db.get_all('user_goals', {'user': self.id}):
+            next_reset = self.calculate_user_reset_time(user_goal['type'])
+            self.__db.update('user_goals', {'reset': next_reset}, {'id': user_goal['id']})
+            resets.append(next_reset)
+
+        # Make sure the reset task will run in time for the earliest of them.
+        if resets:
+            Goal.schedule_reset(min(resets))
 
     def delete_goal(self, type):
         """
@@ -470,46 +597,28 @@ class User:
 
     async def add_to_goals(self, amount):
         """
-        Add word written to all goals the user is running
+        Add words written to all goals the user is running.
+        The goals are loaded and updated with one query each, however many goals the user has.
         :param amount:
         :return:
         """
-        for goal in ['daily', 'weekly', 'monthly', 'yearly']:
-            await self.add_to_goal(goal, amount)
-
-    async def add_to_goal(self, type, amount):
-        """
-        Add words written to a goal for the user
-        :param type:
-        :param amount:
-        :return:
-        """
-
-        user_goal = self.get_goal(type)
-        if user_goal:
-
-            value = int(amount) + int(user_goal['current'])
-            if value < 0:
-                value = 0
+        completed = await User.bulk_add_to_goals({int(self.id): int(amount)})
 
-            # Is the goal completed now?
-            already_completed = user_goal['completed']
-            completed = user_goal['completed']
-            if value >= user_goal['goal'] and not already_completed:
-                completed = 1
+        xp = 0
+        stats = {}
+        messages = []
+        for user_goal in completed:
+            # Increment stat of goals completed
+            stats[user_goal['type'] + '_goals_completed'] = 1
 
-            self.__db.update('user_goals', {'current': value, 'completed': completed}, {'id': user_goal['id']})
+            xp += Experience.XP_COMPLETE_GOAL[user_goal['type']]
+            messages.append(f"{self.get_mention()} has met their {user_goal['type']} goal of {user_goal['goal']} words!       +{Experience.XP_COMPLETE_GOAL[user_goal['type']]}xp!")
 
-            # If we just met the goal, increment the XP and print out a message
-            if completed and not already_completed:
-                # Increment stat of goals completed
-                self.add_stat(type + '_goals_completed', 1)
-
-                # Increment XP
-                await self.add_xp(Experience.XP_COMPLETE_GOAL[type])
-
-                # Print message
-                await self.say(f"{self.get_mention()} has met their {type} goal of {user_goal['goal']} words!       +{Experience.XP_COMPLETE_GOAL[type]}xp!")
+        # If we just met any goals, increment the XP and print out a message
+        if messages:
+            self.add_stats(stats)
+            await self.add_xp(xp)
+            await self.say('\n'.join(messages))
 
     def update_goal(self, type, amount):
         """
@@ -549,44 +658,132 @@ class User:
 
         return self.__db.get_all('user_goals_history', {'type': type, 'user': self.id}, '*', ['id DESC'], max)
 
-    def reset_goal(self, record):
+    def get_most_recent_sprint(self, current_sprint):
         """
-        Reset a user's goal, inserting the current values into the history table and updating their current record.
-        :param record:
+        Get the user's most recent sprint record, not including the current one (if they have joined already)
         :return:
         """
-        # Add the current values to a new record in the history table.
-        self.__db.insert('user_goals_history', {
-            'user': record['user'],
-            'type': record['type'],
-            'date': self.get_previous_goal_date(record['type']),
-            'goal': record['goal'],
-            'result': record['current'],
-            'completed': record['completed']
-        })
+        return self.__db.get_sql('SELECT * FROM sprint_users WHERE user = %s AND sprint != %s ORDER BY id DESC LIMIT 1',
+                                 [self.id, current_sprint])
+
+    @staticmethod
+    async def bulk_add_to_goals(amounts, db=None):
+        """
+        Add words written to the goals of multiple users at once.
+        The goals are loaded and updated with one query each, however many users and goals there are.
+        :param amounts: Dictionary of user id => words written
+        :param db: The AsyncDatabase, or a transaction started on it, to run the queries on
+        :return: list The user_goals records (as they were before the update) of the goals which were just completed
+        """
+        amounts = {int(user_id): int(amount) for user_id, amount in amounts.items()}
+        if not amounts:
+            return []
+
+        db = db or AsyncDatabase.instance()
+        ids = list(amounts.keys())
+
+        # Load all of their goals at once.
+        user_goals = await db.get_all_sql(f"SELECT * FROM user_goals WHERE user IN {build_in(ids)}", ids)
+        if not user_goals:
+            return []
+
+        # Update all of them in one statement. MySQL assigns the columns left to right, so `completed` is worked out
+        # from the value of `current` before the words were added to it.
+        case, params = build_case('user', amounts)
+        await db.execute(
+            f"UPDATE user_goals SET completed = IF(completed = 0 AND GREATEST(current + {case}, 0) >= goal, 1, completed), "
+            f"current = GREATEST(current + {case}, 0) WHERE user IN {build_in(ids)}",
+            params + params + ids
+        )
 
-        # Calculate the next reset time for this goal.
-        next = self.calculate_user_reset_time(record['type'])
+        # Work out which goals just completed, from the records we loaded.
+        completed = []
+        for user_goal in user_goals:
+            value = max(int(user_goal['current']) + amounts[int(user_goal['user'])], 0)
+            if value >= user_goal['goal'] and not user_goal['completed']:
+                completed.append(user_goal)
 
-        # Update the goal record with the new reset time, resetting the completed and current values to 0.
-        self.__db.update('user_goals', {'completed': 0, 'current': 0, 'reset': next}, {'id': record['id']})
+        return completed
 
-    def get_previous_goal_date(self, type):
+    @staticmethod
+    async def bulk_add_stats(stats, db=None):
         """
-        Given a type of goal, get the previous goal's date, for the history table.
-        E.g. a daily goal would give you yesterday's date. A monthly goal would give you the first of last month.
-        :param type:
+        Increment stats for multiple users at once
+        :param stats: Dictionary of user id => dictionary of stat name => amount
+        :param db: The AsyncDatabase, or a transaction started on it, to run the queries on
         :return:
         """
-        timezone = self.get_setting('timezone') or 'UTC'
-        return self.__helper.get_previous_date(timezone, type)
+        buffered = []
+        rows = []
+        for user_id, user_stats in stats.items():
+            for name, amount in user_stats.items():
+                if name in StatBuffer.STATS:
+                    buffered.append((user_id, name, amount))
+                else:
+                    rows.append({'user': user_id, 'name': name, 'value': int(amount)})
 
-    def get_most_recent_sprint(self, current_sprint):
+        if rows:
+            await (db or AsyncDatabase.instance()).upsert('user_stats', rows, ['value'], True)
+
+        buffer = StatBuffer.instance()
+        for user_id, name, amount in buffered:
+            buffer.add(user_id, name, amount)
+
+    @staticmethod
+    async def bulk_add_xp(amounts, db=None):
         """
-        Get the user's most recent sprint record, not including the current one (if they have joined already)
-        :return:
+        Add XP to multiple users at once
+        :param amounts: Dictionary of user id => XP to add
+        :param db: The AsyncDatabase, or a transaction started on it, to run the queries on
+        :return: dict User id => new level, for the users who went up a level
         """
-        return self.__db.get_sql('SELECT * FROM sprint_users WHERE user = %s AND sprint != %s ORDER BY id DESC LIMIT 1',
-                                 [self.id, current_sprint])
+        amounts = {int(user_id): int(amount) for user_id, amount in amounts.items()}
+        if not amounts:
+            return {}
+
+        db = db or AsyncDatabase.instance()
+        ids = list(amounts.keys())
+
+        records = await db.get_all_sql(f"SELECT user, xp FROM user_xp WHERE user IN {build_in(ids)}", ids)
+        before = {int(row['user']): int(row['xp']) for row in records}
+
+        await db.upsert('user_xp', [{'user': user_id, 'xp': amount} for user_id, amount in amounts.items()], ['xp'], True)
 
+        levels = {}
+        for user_id, amount in amounts.items():
+            level = Experience(before.get(user_id, 0) + amount).get_level()
+            if level > Experience(before.get(user_id, 0)).get_level():
+                levels[user_id] = level
+
+        return levels
+
+    @staticmethod
+    async def bulk_get_records(name, ids, db=None):
+        """
+        Get a record for multiple users at once
+        :param name:
+        :param ids:
+        :param db: The AsyncDatabase, or a transaction started on it, to run the query on
+        :return: dict User id => value, for the users who have the record
+        """
+        if not ids:
+            return {}
+
+        records = await (db or AsyncDatabase.instance()).get_all_sql(f"SELECT user, value FROM user_records WHERE record = %s AND user IN {build_in(ids)}",
+                                                                     [name] + list(ids))
+        return {int(row['user']): row['value'] for row in records}
+
+    @staticmethod
+    async def bulk_update_records(name, values, db=None):
+        """
+        Update a record for multiple users at once
+        :param name:
+        :param values: Dictionary of user id => value
+        :param db: The AsyncDatabase, or a transaction started on it, to run the query on
+        :return:
+        """
+        if not values:
+            return 0
 
+        rows = [{'user': user_id, 'record': name, 'value': value} for user_id, value in values.items()]
+        return await (db or AsyncDatabase.instance()).upsert('user_records', rows, ['value'])
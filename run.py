@@ -1,8 +1,12 @@
-import interactions, logging, os
+import asyncio, interactions, logging, os, signal, time
 from interactions.ext.autosharder import shard
-from interactions.ext.tasks import IntervalTrigger, create_task
+from models.bus import Bus
 from models.database import Database
+from models.guild import Guild
 from models.helper import Helper
+from models.migration import Migration
+from models.sprint_registry import SprintRegistry
+from models.stat_buffer import StatBuffer
 from models.task import Task
 from config import TOKEN, APP_DIR
 
@@ -27,17 +31,69 @@ def load_commands(bot):
             bot.load(f"exts.{ext}")
             helper.log(f"[BOT] Loaded command extension {ext}")
 
+def shutdown(name):
+    """
+    Stop the bot when the process is told to exit (e.g. SIGTERM from a process manager).
+    Cancelling the running tasks, including the bot's start task, makes bot.start() return, so the `finally` below can
+    write out any buffered stats.
+    :param name: Name of the signal received
+    :return:
+    """
+    helper.log(f"[BOT] Received {name}, shutting down")
+    for task in asyncio.all_tasks(asyncio.get_event_loop()):
+        task.cancel()
+
+def elapsed(since):
+    """
+    Get the number of milliseconds since a perf_counter() time, for logging how long each boot phase takes.
+    :param since:
+    :return:
+    """
+    return round((time.perf_counter() - since) * 1000)
+
 helper.log("[BOT] Beginning boot process")
+boot = time.perf_counter()
 
-db.install()
-helper.log("[BOT] Database tables installed")
+# Only install and update the tables if the schema has changed since they were last installed.
+phase = time.perf_counter()
+if db.is_installed():
+    helper.log(f"[BOT] Database schema up to date, skipped install ({elapsed(phase)}ms)")
+else:
+    db.install()
+    updates = Migration().run()
+    db.set_installed()
+    helper.log(f"[BOT] Database tables installed and {updates} update(s) applied ({elapsed(phase)}ms)")
 
+phase = time.perf_counter()
 load_commands(bot)
-helper.log("[BOT] Commands loaded")
+helper.log(f"[BOT] Commands loaded ({elapsed(phase)}ms)")
+
+phase = time.perf_counter()
+guilds = Guild.load_all()
+helper.log(f"[BOT] Settings cached for {guilds} guild(s) ({elapsed(phase)}ms)")
 
+phase = time.perf_counter()
+sprints = SprintRegistry.instance().load()
+helper.log(f"[BOT] Loaded {sprints} active sprint(s) ({elapsed(phase)}ms)")
+
+phase = time.perf_counter()
 Task.setup(bot)
-helper.log("[BOT] Tasks loaded")
+helper.log(f"[BOT] Tasks loaded ({elapsed(phase)}ms)")
+
+helper.log(f"[BOT] Boot process completed ({elapsed(boot)}ms)")
+
+Task.start(bot)
+StatBuffer.instance().start()
+asyncio.get_event_loop().create_task(Bus.instance().start())
 
-Task.all.start(bot)
+for name in ['SIGINT', 'SIGTERM']:
+    asyncio.get_event_loop().add_signal_handler(getattr(signal, name), shutdown, name)
 
-bot.start()
\ No newline at end of file
+# Write out any buffered stats before we exit.
+try:
+    bot.start()
+except asyncio.CancelledError:
+    pass
+finally:
+    StatBuffer.instance().flush()
+    Bus.instance().close()
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Benchmark how many queries, and how long, some of the bot's database work takes.
+Run it from the scripts/ directory, like the other scripts, against a database with some data in it:
+
+    python3 benchmark.py profile <user id> [iterations]
+    python3 benchmark.py sprint <participants, e.g. 10,100,1000> [iterations]
+"""
+import asyncio, os, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.async_database import AsyncDatabase
+from models.database import Database, build_in
+from models.sprint import Sprint
+from models.stat_buffer import StatBuffer
+from models.user import User
+
+# The stats shown on /profile.
+PROFILE_STATS = ['total_words_written', 'sprints_words_written', 'sprints_started', 'sprints_completed', 'sprints_won',
+                 'challenges_completed', 'daily_goals_completed', 'weekly_goals_completed', 'monthly_goals_completed',
+                 'yearly_goals_completed']
+
+# The ids used for the fake users and guild in the sprint benchmark. Real Discord ids are far larger than these.
+BENCHMARK_USER_ID = 1
+BENCHMARK_GUILD_ID = 1
+
+def count_queries():
+    """
+    Get the number of queries run so far, on both the blocking and the async database
+    :return: int
+    """
+    return Database.instance().queries + AsyncDatabase.instance().queries
+
+def measure(function, iterations):
+    """
+    Run a function a number of times, and work out the average number of queries and time taken per run
+    :param function:
+    :param iterations:
+    :return: tuple of (queries, milliseconds)
+    """
+    queries = count_queries()
+    start = time.perf_counter()
+
+    for i in range(iterations):
+        function()
+
+    elapsed = (time.perf_counter() - start) * 1000
+    return (count_queries() - queries) / iterations, elapsed / iterations
+
+def report(name, queries, milliseconds):
+    """
+    Print the result of a benchmark
+    :param name:
+    :param queries:
+    :param milliseconds:
+    :return:
+    """
+    print(f"{name:<30} {queries:>8.1f} queries {milliseconds:>10.2f}ms")
+
+def benchmark_profile(user_id, iterations=100):
+    """
+    Compare loading a /profile with the separate get_xp_bar() and get_stat() calls, against User.load_profile()
+    :param user_id:
+    :param iterations:
+    :return:
+    """
+    def separate():
+        user = User(user_id, 0)
+        user.get_xp_bar()
+        for name in PROFILE_STATS:
+            user.get_stat(name)
+
+    def snapshot():
+        profile = User(user_id, 0).load_profile()
+        profile.get_xp_bar()
+        for name in PROFILE_STATS:
+            profile.get_stat(name)
+
+    report('profile (separate queries)', *measure(separate, iterations))
+    report('profile (load_profile)', *measure(snapshot, iterations))
+
+def create_benchmark_sprint(users):
+    """
+    Create a finished sprint, with a number of fake users who have all submitted their word counts and have daily goals
+    :param users:
+    :return: Sprint
+    """
+    db = Database.instance()
+    now = int(time.time())
+
+    sprint = Sprint.create(BENCHMARK_GUILD_ID, 1, now - 1200, 0, now - 600, 600, users[0], now - 1200)
+    for index, user_id in enumerate(users):
+        db.insert('sprint_users', {'sprint': sprint.id, 'user': user_id, 'timejoined': now - 1200, 'starting_wc': 0,
+                                   'current_wc': 100 + index, 'ending_wc': 100 + index})
+        db.insert('user_goals', {'user': user_id, 'type': 'daily', 'goal': 500, 'current': 450, 'completed': 0,
+                                 'reset': now + 86400})
+
+    return sprint
+
+def delete_benchmark_sprint(sprint, users):
+    """
+    Delete a benchmark sprint and everything it wrote for its fake users
+    :param sprint:
+    :param users:
+    :return:
+    """
+    db = Database.instance()
+    buffer = StatBuffer.instance()
+
+    for user_id in users:
+        buffer.discard(user_id)
+
+    for table in ['user_stats', 'user_records', 'user_xp', 'user_goals', 'user_goals_history']:
+        db.execute(f"DELETE FROM {table} WHERE user IN {build_in(users)}", users)
+
+    db.delete('sprint_users', {'sprint': sprint.id})
+    db.delete('sprints', {'id': sprint.id})
+
+async def complete_benchmark_sprint(sprint):
+    """
+    Complete a benchmark sprint, then close the connection pool, as each run has its own event loop
+    :param sprint:
+    :return:
+    """
+    try:
+        await sprint.complete_sprint()
+    finally:
+        await AsyncDatabase.instance().close()
+
+def benchmark_sprint(participants, iterations=1):
+    """
+    Time completing sprints with different numbers of participants
+    :param participants: Comma separated list of sizes, e.g. 10,100,1000
+    :param iterations:
+    :return:
+    """
+    for size in [int(size) for size in participants.split(',')]:
+        users = list(range(BENCHMARK_USER_ID, BENCHMARK_USER_ID + size))
+        queries = 0
+        elapsed = 0
+
+        for i in range(iterations):
+            sprint = create_benchmark_sprint(users)
+            try:
+                result = measure(lambda: asyncio.run(complete_benchmark_sprint(sprint)), 1)
+                queries += result[0]
+                elapsed += result[1]
+            finally:
+                delete_benchmark_sprint(sprint, users)
+
+        report(f"sprint ({size} participants)", queries / iterations, elapsed / iterations)
+
+MODES = {
+    'profile': benchmark_profile,
+    'sprint': benchmark_sprint,
+}
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3 or sys.argv[1] not in MODES:
+        print(f"Usage: python3 benchmark.py <{'|'.join(MODES)}> <argument> [iterations]")
+        sys.exit(1)
+
+    MODES[sys.argv[1]](sys.argv[2], *[int(arg) for arg in sys.argv[3:4]])